@@ -1,7 +1,6 @@
 import datetime as dt
-import math
-import time
 import pytz
+import uuid
 
 import gspread
 import numpy as np
@@ -10,11 +9,43 @@ import streamlit as st
 from oauth2client.service_account import ServiceAccountCredentials
 from st_aggrid import AgGrid, GridOptionsBuilder, GridUpdateMode, JsCode
 from streamlit_option_menu import option_menu
-from streamlit_autorefresh import st_autorefresh
+
+from job_archive import ArchiveWorker, JobArchive
+from job_changes import IdAllocator, JobChanges, clean_value, diff_cells
+from job_data import (
+    ChangeBus,
+    DataVersion,
+    FilterIndex,
+    JobIndex,
+    RevenueRollup,
+    SnapshotPoller,
+    machine_occupancy,
+)
+from job_states import JobStateMachine
+from job_views import (
+    HIDDEN_COLUMNS,
+    PAGE_SIZES,
+    ROLE_VIEWS,
+    ViewPlan,
+    compact,
+    encode_codes,
+    grid_columns,
+    page_slice,
+)
+from job_snapshot import DiskSnapshot
+from job_store import GoogleSheetStore, SQLiteStore
+from sheet_quota import QuotaProxy, SheetQuota
+from write_queue import WriteBehindStore
 
 
 south_africa_tz = pytz.timezone('Africa/Johannesburg')
 
+# Spreadsheet holding the live jobs and the archive tab
+# TODO: Change the sheet source when going live
+JOBS_SPREADSHEET = "Foilworx_jobs"
+# Test sheet
+# JOBS_SPREADSHEET = "Foilworx_test"
+
 @st.cache_resource
 def get_gspread_client():
     scope = [
@@ -25,55 +56,195 @@ def get_gspread_client():
         st.secrets["google"], scope
     )
     client = gspread.authorize(creds)
-    return client
+    # Every sheet call is budgeted, retried on 429s and counted
+    return QuotaProxy(client, get_sheet_quota())
 
 
-@st.cache_data
-def fetch_sheet_data(_sheet):
-    worksheet = _sheet.get_all_records()
-    df = pd.DataFrame(worksheet)
-    return df
+@st.cache_resource
+def get_sheet_quota():
+    store_config = st.secrets.get("store", {})
+    return SheetQuota(per_minute=store_config.get("requests_per_minute", 60))
 
 
-client = get_gspread_client()
-# TODO: Change the sheet source when going live
-sheet = client.open("Foilworx_jobs").sheet1
+@st.cache_resource
+def get_id_allocator():
+    return IdAllocator()
 
-# Test sheet
-# sheet = client.open("Foilworx_test").sheet1
+
+@st.cache_resource
+def get_state_machine():
+    return JobStateMachine.from_csv("foilworx_status_list.csv")
+
+
+@st.cache_resource
+def get_machines():
+    # CNC machines in the workshop, in the order the sidebar lists them
+    return pd.read_csv("foilworx_machine_list.csv")["Machine"].tolist()
+
+
+@st.cache_resource
+def get_job_store():
+    store_config = st.secrets.get("store", {})
+
+    def open_sheet():
+        worksheet = get_gspread_client().open(JOBS_SPREADSHEET).sheet1
+        # Sheet writes are queued and flushed in the background
+        return WriteBehindStore(GoogleSheetStore(worksheet), version=get_data_version())
+
+    if store_config.get("backend", "sheets") == "sqlite":
+        # Local database, with the sheet kept as an optional mirror
+        mirror = open_sheet() if store_config.get("mirror", False) else None
+        return SQLiteStore(
+            store_config.get("sqlite_path", "foilworx_jobs.db"), mirror=mirror
+        )
+    return open_sheet()
+
+
+@st.cache_resource
+def get_change_bus():
+    return ChangeBus()
+
+
+@st.cache_resource
+def get_job_archive():
+    store_config = st.secrets.get("store", {})
+    worksheet = None
+    if store_config.get("backend", "sheets") == "sheets" or store_config.get("mirror", False):
+        spreadsheet = get_gspread_client().open(JOBS_SPREADSHEET)
+        try:
+            worksheet = spreadsheet.worksheet("Archive")
+        except gspread.WorksheetNotFound:
+            worksheet = spreadsheet.add_worksheet("Archive", rows=1000, cols=40)
+    return JobArchive(store_config.get("archive_path", "foilworx_archive"), worksheet)
+
+
+@st.cache_resource
+def get_archive_worker():
+    # Delivered jobs older than this leave the live sheet
+    older_than_days = st.secrets.get("store", {}).get("archive_after_days", 90)
+    return ArchiveWorker(get_job_archive(), get_job_store(), get_data_version(), older_than_days)
+
+
+@st.cache_data(max_entries=8)
+def fetch_archive(_archive, since, generation):
+    # Only read when a report or the history view asks for it
+    return _archive.load(since)
+
+
+@st.cache_resource(max_entries=2)
+def get_archive_rollup(_archive, generation):
+    return RevenueRollup(fetch_archive(_archive, None, generation))
+
+
+@st.cache_resource
+def get_data_version():
+    return DataVersion(get_change_bus())
+
+
+# Edits made straight in the sheet are picked up after this many seconds.
+# Writes from the app reach other sessions through the change bus instead.
+SNAPSHOT_TTL = 300
+
+# How often each open page checks the change bus. The check never reads the sheet.
+CHANGE_CHECK_SECONDS = 2
+
+
+@st.cache_resource
+def get_snapshot_poller():
+    # One sheet read per interval for the whole process, however many screens are open
+    return SnapshotPoller(
+        get_job_store(),
+        get_data_version(),
+        SNAPSHOT_TTL,
+        bus=get_change_bus(),
+        pace=get_sheet_quota().stretch,
+        disk=DiskSnapshot(st.secrets.get("store", {}).get("snapshot_path", "foilworx_jobs.arrow")),
+    )
+
+
+@st.cache_data(max_entries=4)
+def fetch_jobs(_poller, snapshot):
+    # The poller types each frame once, this hands every rerun its own copy
+    return _poller.frame(snapshot)
+
+
+@st.cache_resource(max_entries=4)
+def get_job_index(_poller, snapshot):
+    return JobIndex(fetch_jobs(_poller, snapshot))
+
+
+@st.cache_resource(max_entries=4)
+def get_filter_index(_poller, snapshot):
+    return FilterIndex(fetch_jobs(_poller, snapshot))
+
+
+@st.cache_data(max_entries=2)
+def fetch_history(_poller, snapshot, _archive, generation):
+    # Live and archived jobs together, for searching the whole history
+    return pd.concat(
+        [fetch_jobs(_poller, snapshot), fetch_archive(_archive, None, generation)],
+        ignore_index=True,
+    )
+
+
+@st.cache_resource(max_entries=2)
+def get_history_filter_index(_poller, snapshot, _archive, generation):
+    return FilterIndex(fetch_history(_poller, snapshot, _archive, generation))
+
+
+@st.cache_resource(max_entries=4)
+def get_revenue_rollup(_poller, snapshot):
+    return RevenueRollup(fetch_jobs(_poller, snapshot))
+
+
+@st.cache_data(max_entries=4)
+def get_machine_occupancy(_poller, snapshot):
+    return machine_occupancy(fetch_jobs(_poller, snapshot), get_machines())
+
+
+def hide_helper_columns(gb, df):
+    for column in HIDDEN_COLUMNS:
+        if column in df.columns:
+            gb.configure_column(column, hide=True)
 
 
 class Production:
     def __init__(self):
+        self.store = get_job_store()
+        self.poller = get_snapshot_poller()
+        get_archive_worker()
+        self.snapshot = None
+        self.seen_change = 0
         self.jobs_df = pd.DataFrame()
+        self.id_rows = {}
         self.today = pd.to_datetime(dt.datetime.now(south_africa_tz).strftime("%Y/%m/%d %H:%M"))
         self.new_status = ""
+        self.displaytype = None
+        # Names this session's queued writes, so ones dropped later are shown here
+        self.origin = st.session_state.setdefault("write_origin", uuid.uuid4().hex)
 
     def format_data(self):
-        df = fetch_sheet_data(sheet)
-        df["JobAddedTime"] = pd.to_datetime(df["JobAddedTime"])
-        df["MachineTime"] = pd.to_datetime(df["MachineTime"], format="%H:%M:%S").dt.time
-        df["EstimatedDeliveryDate"] = pd.to_datetime(df["EstimatedDeliveryDate"])
-        df["ArtworkCompleteTime"] = pd.to_datetime(df["ArtworkCompleteTime"])
-        df["CODPaymentTime"] = pd.to_datetime(df["CODPaymentTime"])
-        df["CNCStartTime"] = pd.to_datetime(df["CNCStartTime"])
-        df["CNCCompleteTime"] = pd.to_datetime(df["CNCCompleteTime"])
-        df["FinishingCompleteTime"] = pd.to_datetime(df["FinishingCompleteTime"])
-        df["ProofApprovalTime"] = pd.to_datetime(df["ProofApprovalTime"])
-        df["JobCompletedTime"] = pd.to_datetime(df["JobCompletedTime"])
-        self.jobs_df = df.copy()
+        # Taken before the snapshot so a change landing in between still triggers a rerun
+        self.seen_change = get_change_bus().seq
+        self.snapshot = self.poller.latest()
+        self.jobs_df = fetch_jobs(self.poller, self.snapshot)
+        self.id_rows = get_job_index(self.poller, self.snapshot).id_rows
 
     def display_data(self, displaytype, fullname):
         from streamlit_extras.metric_cards import style_metric_cards
 
+        self.displaytype = displaytype
         self.format_data()
-
-        def clean_value(val):
-            if val is None:
-                return ""
-            if isinstance(val, float) and math.isnan(val):
-                return ""
-            return str(val)
+        # Failed writes stay on screen across reruns until they are dismissed. That includes
+        # the ones this session queued that the store turned down after the page moved on
+        job_errors = st.session_state.setdefault("job_errors", {})
+        job_errors.update(self.store.take_rejected(self.origin))
+        if job_errors:
+            for j_id, message in job_errors.items():
+                st.error(f"Job {j_id} {message}")
+            if st.button("Dismiss", key="dismiss_job_errors"):
+                job_errors.clear()
+                st.rerun()
 
         # TODO: Use the below functions to create the all button.
         def av_options(df, options):
@@ -96,14 +267,13 @@ class Production:
                     st.session_state["max_selections"] = len(available_options)
 
         # Create filters for all jobs
-        def filter_all_jobs(df):
-            df_selection = pd.DataFrame()
+        def filter_all_jobs(df, filter_index):
             search_more = st.checkbox(label="Search Jobs", key="show_more")
             if st.session_state.show_more:
                 col1, col2, col3, col4 = st.columns(4)
+                # Option lists come sorted from the index built once per snapshot
                 with col1:
-                    user_list = self.jobs_df["DTPOperator"].unique().tolist()
-                    user_list.sort()
+                    user_list = filter_index.options["DTPOperator"]
                     user_search = st.multiselect(
                         label="User",
                         options=user_list,
@@ -111,41 +281,37 @@ class Production:
                     )
                     # TODO: Use the length of the array to fill the table.
                 with col2:
-                    company_list = self.jobs_df["Client"].unique().tolist()
-                    company_list.sort()
+                    company_list = filter_index.options["Client"]
                     company_search = st.multiselect(
                         label="Company",
                         options=company_list,
                         default=company_list,
                     )
                 with col3:
-                    job_type_list = self.jobs_df["JobName"].unique().tolist()
-                    job_type_list.sort()
+                    job_type_list = filter_index.options["JobName"]
                     job_type_search = st.multiselect(
                         label="Job Name",
                         options=job_type_list,
                         default=job_type_list,
                     )
                 with col4:
-                    material_list = self.jobs_df["Material"].unique().tolist()
-                    material_list.sort()
+                    material_list = filter_index.options["Material"]
                     material_search = st.multiselect(
                         label="Material",
                         options=material_list,
                         default=material_list,
                     )
-                df_selection = df.query(
-                    "DTPOperator==@user_search & Client==@company_search & JobName==@job_type_search & Material==@material_search"
+                mask = filter_index.mask(
+                    DTPOperator=user_search,
+                    Client=company_search,
+                    JobName=job_type_search,
+                    Material=material_search,
                 )
-                return df_selection
+                return df.iloc[np.flatnonzero(mask)]
             return df
 
         def invoice_display():
             st.sidebar.subheader("Invoice Total")
-            cost_df = self.jobs_df[["TotalCost", "JobAddedTime"]].copy()
-            cost_df["JobAddedTime"] = pd.to_datetime(
-                pd.to_datetime(cost_df["JobAddedTime"]).dt.strftime("%Y/%m/%d")
-            )
             date_default = pd.to_datetime(self.today.strftime("%Y/%m/%d"))
             with st.sidebar:
                 date1, date2 = st.sidebar.columns(2)
@@ -154,122 +320,99 @@ class Production:
                 with date2:
                     end_date = st.sidebar.date_input("End Date", value=date_default)
 
-                cost_selection = cost_df.query(
-                    "JobAddedTime>=@start_date & JobAddedTime<=@end_date"
-                )
-
-                # st.dataframe(cost_selection)
+                # Both rollups are built once, each range is two binary searches per rollup
+                rollups = [
+                    get_revenue_rollup(self.poller, self.snapshot),
+                    get_archive_rollup(get_job_archive(), get_job_archive().generation),
+                ]
+                total = sum(rollup.total(start_date, end_date) for rollup in rollups)
                 st.metric(
                     label="Invoice Total",
-                    value=cost_selection["TotalCost"].sum(),
+                    value=int(total) if float(total).is_integer() else round(total, 2),
                     delta="",
                 )
 
+                with st.expander("Invoice Breakdown"):
+                    for column in ("ClientType", "DTPOperator"):
+                        split = pd.concat(
+                            [
+                                rollup.breakdown(column, start_date, end_date)
+                                for rollup in rollups
+                                if column in rollup.breakdowns
+                            ]
+                            or [pd.Series(dtype=float)]
+                        )
+                        split = split.groupby(level=0).sum()
+                        st.dataframe(split[split != 0].rename("TotalCost"))
+
         # Refresh button for all users
         # TODO: show the button to all but the dashboard view
         if st.button("Refresh Table"):
-            st.cache_data.clear()
+            self.poller.poll(full=True)
             st.rerun()
 
-        all_artwork_jobs = self.jobs_df.loc[
-            (self.jobs_df["Status"] == "Artwork")
-        ].copy()
-
-        # Added jobs from Artwork
-        pending_jobs = self.jobs_df.loc[
-            (self.jobs_df["Status"].isin(['Artwork', "Artwork Only"]))
-            & (self.jobs_df["DTPOperator"] == fullname)
-        ].copy()
-
-        # Waiting Proof approval data
-        proof_approval = self.jobs_df.loc[
-            self.jobs_df["Status"] == "Waiting Approval"
-        ].copy()
-
-        # Jobs waiting COD Payment
-        waiting_cod_payment = self.jobs_df.loc[
-            (self.jobs_df["DTPOperator"] == fullname)
-            & (self.jobs_df["CODStatus"] == "Not Paid")
-        ].copy()
-
-        # Ready for machine
-        ready_for_machine = self.jobs_df.loc[
-            self.jobs_df["Status"] == "Machining (Not Processed)"
-        ].copy()
-
-        # Display for Machine in process jobs
-        cutting_in_progress = self.jobs_df.loc[
-            self.jobs_df["Status"] == "Machining (In Process)"
-        ].copy()
-
-        # Display for finishing
-        finishing_jobs = self.jobs_df.loc[
-            self.jobs_df["Status"] == "At Finishing"
-        ].copy()
-
-        # Display for QC
-        qc_jobs = self.jobs_df.loc[
-            self.jobs_df["Status"] == "Ready For QC"
-        ].copy()
-
-        # Delivery Jobs
-        delivery_jobs = self.jobs_df.loc[
-            self.jobs_df["Status"] == "Ready for Delivery"
-        ].copy()
-
-        # Delivery Jobs
-        delivered_jobs = self.jobs_df.loc[self.jobs_df["Status"] == "Delivered"].copy()
-
-        # Delivered Today
-        delivered_today = delivered_jobs.loc[delivered_jobs['JobCompletedTime'] >= self.today.strftime("%Y-%m-%d")].copy()
-
-        # Get the current machine in use
-        def machineinuse(df, mac_color, output_need):
-            mac_df = df.loc[
-                (df["MachineInUse"] == mac_color)
-                & (df["Status"] == "Machining (In Process)")
-            ].copy()
-
-            if output_need == "count":
-                mac_count = mac_df["MachineInUse"].count()
-                return mac_count
-            elif output_need == "invoice":
-                job_list = mac_df["Inv No"].tolist()
-                if len(job_list) == 1:
-                    mac_invoice = mac_df["Inv No"].sum()
-                    return str(mac_invoice)
-                elif len(job_list) > 1:
-                    mac_invoice = ""
-                    for inv in job_list:
-                        mac_invoice = mac_invoice + " | " + str(inv)
-                    return mac_invoice
+        seen_change = self.seen_change
+        seen_day = self.today.date()
+
+        @st.fragment(run_every=CHANGE_CHECK_SECONDS)
+        def watch_changes():
+            # Rerun the whole page as soon as any session or the sheet poll changes a job,
+            # and at midnight so a quiet dashboard doesn't keep yesterday's date
+            if (
+                get_change_bus().seq != seen_change
+                or dt.datetime.now(south_africa_tz).date() != seen_day
+            ):
+                st.rerun(scope="app")
+
+        watch_changes()
+
+        # Every status view is a take from one index built per data version
+        index = get_job_index(self.poller, self.snapshot)
+
+        def completed_today(df):
+            return df.loc[df['JobCompletedTime'] >= self.today.strftime("%Y-%m-%d")]
+
+        # View name -> (index filters, optional refinement of the taken rows)
+        view_definitions = {
+            "all_artwork_jobs": ({"Status": "Artwork"}, None),
+            # Added jobs from Artwork
+            "pending_jobs": (
+                {"Status": ["Artwork", "Artwork Only"], "DTPOperator": fullname},
+                None,
+            ),
+            # Waiting Proof approval data
+            "proof_approval": ({"Status": "Waiting Approval"}, None),
+            # Jobs waiting COD Payment
+            "waiting_cod_payment": (
+                {"DTPOperator": fullname, "CODStatus": "Not Paid"},
+                None,
+            ),
+            # Ready for machine
+            "ready_for_machine": ({"Status": "Machining (Not Processed)"}, None),
+            # Display for Machine in process jobs
+            "cutting_in_progress": ({"Status": "Machining (In Process)"}, None),
+            # Display for finishing
+            "finishing_jobs": ({"Status": "At Finishing"}, None),
+            # Display for QC
+            "qc_jobs": ({"Status": "Ready For QC"}, None),
+            # Delivery Jobs
+            "delivery_jobs": ({"Status": "Ready for Delivery"}, None),
+            # Delivered Today
+            "delivered_today": ({"Status": "Delivered"}, completed_today),
+        }
+
+        # Only the views this role can show are planned, and each one is only
+        # taken from the frame when a tab or radio option renders it
+        views = ViewPlan(
+            self.jobs_df, index, view_definitions, ROLE_VIEWS.get(displaytype, [])
+        )
 
         def machine_metrics():
-            st.sidebar.metric(
-                label="Machine - Mufasa",
-                value=machineinuse(self.jobs_df, "Mufasa", "count"),
-                delta=machineinuse(self.jobs_df, "Mufasa", "invoice"),
-            )
-            st.sidebar.metric(
-                label="Machine - Logo",
-                value=machineinuse(self.jobs_df, "Logo", "count"),
-                delta=machineinuse(self.jobs_df, "Logo", "invoice"),
-            )
-            st.sidebar.metric(
-                label="Machine - Fresenius",
-                value=machineinuse(self.jobs_df, "Fresenius", "count"),
-                delta=machineinuse(self.jobs_df, "Fresenius", "invoice"),
-            )
-            st.sidebar.metric(
-                label="Machine - Simba",
-                value=machineinuse(self.jobs_df, "Simba", "count"),
-                delta=machineinuse(self.jobs_df, "Simba", "invoice"),
-            )
-            st.sidebar.metric(
-                label="Machine - Missy",
-                value=machineinuse(self.jobs_df, "Missy", "count"),
-                delta=machineinuse(self.jobs_df, "Missy", "invoice"),
-            )
+            occupancy = get_machine_occupancy(self.poller, self.snapshot)
+            for machine, (count, invoices) in occupancy.items():
+                st.sidebar.metric(
+                    label=f"Machine - {machine}", value=count, delta=invoices
+                )
 
             style_metric_cards(
                 background_color="#ffffff",
@@ -298,50 +441,50 @@ class Production:
             da_col1, da_col2, da_col3 = st.columns(3)
             da_col1.metric(
                 label="Jobs At Artwork",
-                value=all_artwork_jobs["Status"].count(),
+                value=views["all_artwork_jobs"].count(),
                 delta="",
             )
             da_col2.metric(
                 label="Waiting Artwork Approval",
-                value=proof_approval["Status"].count(),
+                value=views["proof_approval"].count(),
                 delta="",
             )
             da_col3.metric(
                 label="Waiting C.O.D Payment",
-                value=waiting_cod_payment["Status"].count(),
+                value=views["waiting_cod_payment"].count(),
                 delta="",
             )
 
             ds_col1, ds_col2, ds_col3 = st.columns(3)
             ds_col1.metric(
                 label="Jobs Ready to Cut",
-                value=ready_for_machine["Status"].count(),
+                value=views["ready_for_machine"].count(),
                 delta="",
             )
             ds_col2.metric(
                 label="Jobs Currently Cutting",
-                value=cutting_in_progress["Status"].count(),
+                value=views["cutting_in_progress"].count(),
                 delta="",
             )
             ds_col3.metric(
                 label="Jobs At Finishing",
-                value=finishing_jobs["Status"].count(),
+                value=views["finishing_jobs"].count(),
                 delta="",
             )
             df_col1, df_col2, df_col3 = st.columns(3)
             df_col1.metric(
                 label="Ready For QC",
-                value=qc_jobs["Status"].count(),
+                value=views["qc_jobs"].count(),
                 delta="",
             )
             df_col2.metric(
                 label="Ready for Delivery",
-                value=delivery_jobs["Status"].count(),
+                value=views["delivery_jobs"].count(),
                 delta="",
             )
             df_col3.metric(
                 label="Delivered",
-                value=delivered_today["Status"].count(),
+                value=views["delivered_today"].count(),
                 delta="",
             )
 
@@ -355,10 +498,8 @@ class Production:
         # Check the display types and display to the user
         # Admin User Dashboard
         if displaytype == 6:
-            st_autorefresh(interval=60_000, key="auto_refresh")
             st.sidebar.markdown("<h4>Machines Currently In Use</h4>", unsafe_allow_html=True)
             machine_metrics()
-            # Auto refresh the data
             dashboard_metrics()
 
         elif displaytype == 1:
@@ -367,6 +508,7 @@ class Production:
 
             machine_metrics()
             invoice_display()
+            self.api_usage()
 
             if selected == "Production Dashboard":
                 dashboard_metrics()
@@ -388,23 +530,47 @@ class Production:
                 )
 
                 if db_radio == "Jobs At Artwork":
-                    AgGrid(all_artwork_jobs, height=400, key="all_artwork_grid")
+                    self.show_grid(
+                        views["all_artwork_jobs"].frame,
+                        "all_artwork_grid",
+                        view="all_artwork_jobs",
+                    )
                 elif db_radio == "Waiting Artwork Approval":
-                    AgGrid(proof_approval, height=400, key="all_artwork_grid")
+                    self.show_grid(
+                        views["proof_approval"].frame, "all_artwork_grid", view="proof_approval"
+                    )
                 elif db_radio == "Waiting C.O.D Payment":
-                    AgGrid(waiting_cod_payment, height=400, key="all_artwork_grid")
+                    self.show_grid(
+                        views["waiting_cod_payment"].frame,
+                        "all_artwork_grid",
+                        view="waiting_cod_payment",
+                    )
                 elif db_radio == "Ready to Cut":
-                    AgGrid(ready_for_machine, height=400, key="all_artwork_grid")
+                    self.show_grid(
+                        views["ready_for_machine"].frame,
+                        "all_artwork_grid",
+                        view="ready_for_machine",
+                    )
                 elif db_radio == "Currently Cutting":
-                    AgGrid(cutting_in_progress, height=400, key="all_artwork_grid")
+                    self.show_grid(
+                        views["cutting_in_progress"].frame,
+                        "all_artwork_grid",
+                        view="cutting_in_progress",
+                    )
                 elif db_radio == "At Finishing":
-                    AgGrid(finishing_jobs, height=400, key="all_artwork_grid")
+                    self.show_grid(
+                        views["finishing_jobs"].frame, "all_artwork_grid", view="finishing_jobs"
+                    )
                 elif db_radio == "Ready For QC":
-                    AgGrid(qc_jobs, height=400, key="all_artwork_grid")
+                    self.show_grid(views["qc_jobs"].frame, "all_artwork_grid", view="qc_jobs")
                 elif db_radio == "Ready For Delivery":
-                    AgGrid(delivery_jobs, height=400, key="all_artwork_grid")
+                    self.show_grid(
+                        views["delivery_jobs"].frame, "all_artwork_grid", view="delivery_jobs"
+                    )
                 elif db_radio == "Delivered":
-                    AgGrid(delivered_today, height=400, key="all_artwork_grid")
+                    self.show_grid(
+                        views["delivered_today"].frame, "all_artwork_grid", view="delivered_today"
+                    )
 
             elif selected == "My Jobs":
                 navigation = st.radio(
@@ -414,27 +580,27 @@ class Production:
                     at_col1, at_col2, at_col3, at_col4, at_col5 = st.columns(5)
                     at_col1.metric(
                         label="Pending",
-                        value=pending_jobs["Status"].count(),
+                        value=views["pending_jobs"].count(),
                         delta="",
                     )
                     at_col2.metric(
                         label="Ready to cut",
-                        value=proof_approval["Status"].count(),
+                        value=views["proof_approval"].count(),
                         delta="",
                     )
                     at_col3.metric(
                         label="Awaiting C.O.D Payment",
-                        value=waiting_cod_payment["Status"].count(),
+                        value=views["waiting_cod_payment"].count(),
                         delta="",
                     )
                     at_col4.metric(
                         label="Currently Cutting",
-                        value=cutting_in_progress["Status"].count(),
+                        value=views["cutting_in_progress"].count(),
                         delta="",
                     )
                     at_col5.metric(
                         label="Ready For QC",
-                        value=qc_jobs["Status"].count(),
+                        value=views["qc_jobs"].count(),
                         delta="",
                     )
 
@@ -460,22 +626,37 @@ class Production:
                         # Display Current Artwork Jobs
                         st.subheader("Pending Jobs")
                         self.update_job(
-                            pending_jobs, "Waiting Approval", "artwork_grid"
+                            views["pending_jobs"].frame,
+                            "Waiting Approval",
+                            "artwork_grid",
+                            view="pending_jobs",
                         )
                     elif atl_radio == "Ready to cut":
                         st.subheader("Ready to cut")
                         self.update_job(
-                            proof_approval, "Machining (Not Processed)", "proof_grid"
+                            views["proof_approval"].frame,
+                            "Machining (Not Processed)",
+                            "proof_grid",
+                            view="proof_approval",
                         )
                     elif atl_radio == "Awaiting C.O.D Payment":
                         st.subheader("Awaiting C.O.D Payment")
-                        self.update_job(waiting_cod_payment, "Paid", "cod_grid")
+                        self.update_job(
+                            views["waiting_cod_payment"].frame,
+                            "Paid",
+                            "cod_grid",
+                            view="waiting_cod_payment",
+                        )
                     elif atl_radio == "Currently Cutting":
                         st.subheader("Currently Cutting")
-                        AgGrid(cutting_in_progress, height=400, key="cur_cutting_grid")
+                        self.show_grid(
+                            views["cutting_in_progress"].frame,
+                            "cur_cutting_grid",
+                            view="cutting_in_progress",
+                        )
                     elif atl_radio == "Ready for QC":
                         st.subheader("Ready For QC")
-                        AgGrid(qc_jobs, height=400, key="qc_cur_grid")
+                        self.show_grid(views["qc_jobs"].frame, "qc_cur_grid", view="qc_jobs")
 
                 elif navigation == "Add Job":
                     self.add_job(fullname=fullname)
@@ -500,27 +681,27 @@ class Production:
                     at_col1, at_col2, at_col3, at_col4, at_col5 = st.columns(5)
                     at_col1.metric(
                         label="Pending",
-                        value=pending_jobs["Status"].count(),
+                        value=views["pending_jobs"].count(),
                         delta="",
                     )
                     at_col2.metric(
                         label="Ready to cut",
-                        value=proof_approval["Status"].count(),
+                        value=views["proof_approval"].count(),
                         delta="",
                     )
                     at_col3.metric(
                         label="Awaiting C.O.D Payment",
-                        value=waiting_cod_payment["Status"].count(),
+                        value=views["waiting_cod_payment"].count(),
                         delta="",
                     )
                     at_col4.metric(
                         label="Currently Cutting",
-                        value=cutting_in_progress["Status"].count(),
+                        value=views["cutting_in_progress"].count(),
                         delta="",
                     )
                     at_col5.metric(
                         label="Ready For QC",
-                        value=qc_jobs["Status"].count(),
+                        value=views["qc_jobs"].count(),
                         delta="",
                     )
 
@@ -546,41 +727,88 @@ class Production:
                         # Display Current Artwork Jobs
                         st.subheader("Pending Jobs")
                         self.update_job(
-                            pending_jobs, "Waiting Approval", "artwork_grid"
+                            views["pending_jobs"].frame,
+                            "Waiting Approval",
+                            "artwork_grid",
+                            view="pending_jobs",
                         )
                     elif atl_radio == "Ready to cut":
                         st.subheader("Ready to cut")
                         self.update_job(
-                            proof_approval, "Machining (Not Processed)", "proof_grid"
+                            views["proof_approval"].frame,
+                            "Machining (Not Processed)",
+                            "proof_grid",
+                            view="proof_approval",
                         )
                     elif atl_radio == "Awaiting C.O.D Payment":
                         st.subheader("Awaiting C.O.D Payment")
-                        self.update_job(waiting_cod_payment, "Paid", "cod_grid")
+                        self.update_job(
+                            views["waiting_cod_payment"].frame,
+                            "Paid",
+                            "cod_grid",
+                            view="waiting_cod_payment",
+                        )
                     elif atl_radio == "Currently Cutting":
                         st.subheader("Currently Cutting")
-                        AgGrid(cutting_in_progress, height=400, key="cur_cutting_grid")
+                        self.show_grid(
+                            views["cutting_in_progress"].frame,
+                            "cur_cutting_grid",
+                            view="cutting_in_progress",
+                        )
                     elif atl_radio == "Ready for QC":
                         st.subheader("Ready For QC")
-                        AgGrid(qc_jobs, height=400, key="qc_cur_grid")
+                        self.show_grid(views["qc_jobs"].frame, "qc_cur_grid", view="qc_jobs")
 
 
                 elif at_radio == "Add Job":
                     self.add_job(fullname)
             elif selected == "All Jobs":
                 st.subheader("All Jobs")
-                job_selection = filter_all_jobs(self.jobs_df)
-                gb = GridOptionsBuilder.from_dataframe(job_selection)
-                gb.configure_selection("multiple", use_checkbox=True)
-                gb.configure_default_column(editable=True)
+                archived = st.checkbox("Include archived jobs")
+                if archived:
+                    archive = get_job_archive()
+                    all_jobs = fetch_history(self.poller, self.snapshot, archive, archive.generation)
+                    filter_index = get_history_filter_index(
+                        self.poller, self.snapshot, archive, archive.generation
+                    )
+                else:
+                    all_jobs = self.jobs_df
+                    filter_index = get_filter_index(self.poller, self.snapshot)
+                job_selection = filter_all_jobs(all_jobs, filter_index)
+                # Only the current page goes to the browser
+                # Every column stays editable here, only the dates go out as text
+                job_page = compact(self.grid_page(job_selection, "all_jobs_grid"))
+                gb = GridOptionsBuilder.from_dataframe(job_page)
+                if archived:
+                    # Archived jobs are history, so they can be looked at but not changed
+                    st.caption("Untick Include archived jobs to edit or delete jobs.")
+                else:
+                    gb.configure_selection("multiple", use_checkbox=True)
+                    gb.configure_default_column(editable=True)
+                hide_helper_columns(gb, job_page)
                 gridOptions = gb.build()
 
                 all_grid_response = AgGrid(
-                    job_selection,
+                    job_page,
                     gridOptions=gridOptions,
                     height=1000,
                     update_mode=GridUpdateMode.MODEL_CHANGED,
-                    key="all_jobs_grid",
+                    key="all_jobs_history_grid" if archived else "all_jobs_grid",
+                )
+
+                # Only cells that differ from the snapshot get saved, shown here first
+                edits = diff_cells(
+                    self.jobs_df, pd.DataFrame(all_grid_response["data"]), self.id_rows
                 )
+                if not archived and not edits.empty:
+                    with st.expander(f"Unsaved changes ({len(edits)})", expanded=True):
+                        st.dataframe(
+                            edits.assign(
+                                old=edits["old"].map(clean_value),
+                                new=edits["new"].map(clean_value),
+                            ),
+                            hide_index=True,
+                        )
 
                 # Download button
                 @st.cache_data
@@ -598,87 +826,57 @@ class Production:
                         file_name=f"foilworx-download-{self.today}.csv",
                         mime="text/csv",
                     )
-                with aj_col2:
-                    save_button = st.button("Save Updates")
 
-                if save_button:
-                    ag_data = pd.DataFrame(all_grid_response["data"])
+                # Edits and deletes only reach live jobs, so archived rows get neither
+                if not archived:
+                    with aj_col2:
+                        save_button = st.button("Save Updates", disabled=edits.empty)
 
-                    common_columns = self.jobs_df.columns.intersection(ag_data.columns)
+                    if save_button:
+                        changes = JobChanges(self.jobs_df, self.id_rows)
+                        changes.apply_diff(edits)
 
-                    for _, row in ag_data.iterrows():
-                        mask = self.jobs_df["id"] == row["id"]
+                        results = {job_id: None for job_id in edits["id"].unique()}
+                        results.update(changes.commit(self.store, origin=self.origin))
+                        self.report_batch(results, "updated")
 
-                        if mask.any():
-                            for column in common_columns:
-                                self.jobs_df.loc[mask, column] = row[column]
+                    # Create the deleting job section for all jobs
+                    select_rows = pd.DataFrame(all_grid_response.get("selected_rows", []))
 
-                    clean_data = [
-                        [clean_value(cell) for cell in row]
-                        for row in self.jobs_df.values.tolist()
-                    ]
+                    if not select_rows.empty:
+                        selected_id = select_rows["id"].tolist()
 
-                    sheet.update(
-                        [self.jobs_df.columns.tolist()] + clean_data
-                    )
-                    st.success("Updated")
-                    st.cache_data.clear()
-                    time.sleep(1)
-                    st.rerun()
-
-                # Create the deleting job section for all jobs
-                select_rows = pd.DataFrame(all_grid_response.get("selected_rows", []))
-
-                if not select_rows.empty:
-                    selected_id = select_rows["id"].tolist()
-
-                    with aj_col3:
-                        delete_button = st.button("Delete Job")
+                        with aj_col3:
+                            delete_button = st.button("Delete Job")
 
-                    if delete_button:
-                        for i_id in selected_id:
-                            jobs_to_delete = self.jobs_df.loc[
-                                self.jobs_df["id"] == i_id
-                            ].index
-
-                            # Adjust index for Google Sheets (1-based indexing)
-                            rows_to_delete = [
-                                index + 2 for index in jobs_to_delete
-                            ]  # +2 to skip the header row
-
-                            # Delete rows in reverse order to avoid shifting issues
-                            for row in sorted(rows_to_delete, reverse=True):
-                                sheet.delete_rows(row)
-
-                        st.success("Job has been deleted")
-                        st.cache_data.clear()
-                        time.sleep(1)
-                        st.rerun()
+                        if delete_button:
+                            results = self.store.delete_jobs(selected_id, origin=self.origin)
+                            self.report_batch(results, "deleted")
 
         elif displaytype == 3:
             # Display for the machine ready jobs
             el_col1, el_col2, el_col3, el_col4, el_col5 = st.columns(5)
             el_col1.metric(
-                label="Jobs To Cut", value=ready_for_machine["Status"].count(), delta=""
+                label="Jobs To Cut", value=views["ready_for_machine"].count(), delta=""
             )
             el_col2.metric(
                 label="Jobs Currently Cutting",
-                value=cutting_in_progress["Status"].count(),
+                value=views["cutting_in_progress"].count(),
                 delta="",
             )
             el_col3.metric(
                 label="Jobs At Finishing",
-                value=finishing_jobs["Status"].count(),
+                value=views["finishing_jobs"].count(),
                 delta="",
             )
             el_col4.metric(
                 label="Jobs Ready for QC",
-                value=qc_jobs["Status"].count(),
+                value=views["qc_jobs"].count(),
                 delta="",
             )
             el_col5.metric(
                 label="Jobs Ready for Delivery",
-                value=delivery_jobs["Status"].count(),
+                value=views["delivery_jobs"].count(),
                 delta="",
             )
             style_metric_cards(
@@ -697,23 +895,41 @@ class Production:
                 # Display Machine Jobs
                 st.subheader("Ready For Machine")
                 self.update_job(
-                    ready_for_machine, "Machining (In Process)", "maching_grid"
+                    views["ready_for_machine"].frame,
+                    "Machining (In Process)",
+                    "maching_grid",
+                    view="ready_for_machine",
                 )
             elif el_radio == "Currently Cutting":
                 # Display Cutting
                 st.subheader("Cutting In Process")
-                self.update_job(cutting_in_progress, "At Finishing", "cutting_grid")
+                self.update_job(
+                    views["cutting_in_progress"].frame,
+                    "At Finishing",
+                    "cutting_grid",
+                    view="cutting_in_progress",
+                )
             elif el_radio == "Finishing":
                 # Display Finishing
                 st.subheader("Finishing")
-                self.update_job(finishing_jobs, "Ready For QC", "finishing_grid")
+                self.update_job(
+                    views["finishing_jobs"].frame,
+                    "Ready For QC",
+                    "finishing_grid",
+                    view="finishing_jobs",
+                )
             elif el_radio == "Ready For QC":
                 st.subheader("Quality Checks")
-                self.update_job(qc_jobs, "Ready for Delivery", "qc_grid")
+                self.update_job(
+                    views["qc_jobs"].frame, "Ready for Delivery", "qc_grid", view="qc_jobs"
+                )
             elif el_radio == "Ready For Delivery":
                 st.subheader("Ready For Delivery")
-                delivery_jobs['OverdueCheck'] = np.where(delivery_jobs['EstimatedDeliveryDate'] < self.today.strftime("%Y-%m-%d"), "Overdue", "NotDue")
+                delivery_jobs = views["delivery_jobs"].frame
+                delivery_jobs = delivery_jobs.assign(OverdueCheck=np.where(delivery_jobs['EstimatedDeliveryDate'] < self.today.strftime("%Y-%m-%d"), "Overdue", "NotDue"))
+                delivery_jobs = compact(delivery_jobs, grid_columns(displaytype, "delivery_jobs"))
                 gb = GridOptionsBuilder.from_dataframe(delivery_jobs)
+                hide_helper_columns(gb, delivery_jobs)
 
                 jscode = JsCode("""
                 function(params) {
@@ -742,7 +958,7 @@ class Production:
             # Display jobs for delivery
             dl_col1, dl_col2 = st.columns(2)
             dl_col1.metric(
-                label="Jobs To Deliver", value=delivery_jobs["Status"].count(), delta=""
+                label="Jobs To Deliver", value=views["delivery_jobs"].count(), delta=""
             )
             style_metric_cards(
                 background_color="#ffffff",
@@ -750,23 +966,22 @@ class Production:
                 box_shadow=True,
             )
             st.subheader("Jobs to Deliver")
-            self.update_job(delivery_jobs, "Delivered", "delivery_grid")
+            self.update_job(
+                views["delivery_jobs"].frame, "Delivered", "delivery_grid", view="delivery_jobs"
+            )
 
-    def update_job(self, display_df, status_update, aggrid_key):
+    def update_job(self, display_df, status_update, aggrid_key, view=None):
 
-        def clean_value(val):
-            if val is None:
-                return ""
-            if isinstance(val, float) and math.isnan(val):
-                return ""
-            return str(val)
+        display_df = self.grid_page(display_df, aggrid_key)
 
         # Create grid options
-        display_df['OverdueCheck'] = np.where(display_df['EstimatedDeliveryDate'] < self.today.strftime("%Y-%m-%d"), "Overdue", "NotDue")
+        display_df = display_df.assign(OverdueCheck=np.where(display_df['EstimatedDeliveryDate'] < self.today.strftime("%Y-%m-%d"), "Overdue", "NotDue"))
+        display_df = compact(display_df, grid_columns(self.displaytype, view))
         gb = GridOptionsBuilder.from_dataframe(display_df)
         gb.configure_selection(
             "multiple", use_checkbox=True
         )  # Enable single row selection
+        hide_helper_columns(gb, display_df)
 
         jscode = JsCode("""
         function(params) {
@@ -805,27 +1020,13 @@ class Production:
             new_status = status_update
             machine_choice = ""
             total_cost = 0
-            current_material = self.jobs_df.loc[
-                self.jobs_df["id"] == task_id[0], "Material"
-            ].sum()
+            current_material = self.job_value(task_id[0], "Material")
             material_change = ""
             job_id = 0
-            new_inv = 0
             size_change = ""
             if new_status == "Machining (Not Processed)":
-                current_inv = self.jobs_df.loc[
-                    (self.jobs_df["Inv No"].notnull())
-                ].copy()
-                current_inv["Inv No"] = pd.to_numeric(current_inv["Inv No"])
-                num_list = current_inv["Inv No"].unique().tolist()
-                num_list.sort()
-                new_inv = int(num_list[-1]) + 1
-                inv_no = self.jobs_df.loc[
-                    self.jobs_df["id"] == task_id[0], "Inv No"
-                ].sum()
-                current_size = self.jobs_df.loc[
-                    self.jobs_df["id"] == task_id[0], "Size"
-                ].sum()
+                inv_no = int(self.job_value(task_id[0], "Inv No", 0))
+                current_size = self.job_value(task_id[0], "Size")
 
                 # All Changes into one row
                 cu_col1, cu_col2, cu_col3, cu_col4 = st.columns(4)
@@ -844,162 +1045,49 @@ class Production:
                     size_change = st.text_input(label="Size", value=current_size)
 
             if new_status == "Machining (In Process)":
-                machine_choice = st.selectbox(
-                    "Choose Machine", ["Mufasa", "Logo", "Fresenius", "Simba", "Missy"]
-                )
+                machine_choice = st.selectbox("Choose Machine", get_machines())
 
             btn_col1, btn_col2 = st.columns([0.5, 3])
             with btn_col1:
                 submit_button = st.button("Update Status")
 
             if submit_button:
-                for j_id in task_id:
-                    current_status = self.jobs_df.loc[
-                        self.jobs_df["id"] == j_id, "Status"
-                    ].sum()
-                    current_jobtype = self.jobs_df.loc[
-                        self.jobs_df["id"] == j_id, "JobType"
-                    ].sum()
-                    current_client_type = self.jobs_df.loc[self.jobs_df['id'] == j_id, "ClientType"].sum()
-                    if new_status == "Waiting Approval":
-                        self.jobs_df["Status"] = np.where(
-                            self.jobs_df["id"] == j_id,
-                            new_status,
-                            self.jobs_df["Status"],
-                        )
-                        self.jobs_df.loc[
-                            self.jobs_df["id"] == j_id, "ProofApprovalTime"
-                        ] = self.today
-                    elif new_status == "Machining (Not Processed)":
-                        self.jobs_df["Inv No"] = np.where(
-                            self.jobs_df["id"] == j_id,
-                            np.where(job_id == 0, new_inv, job_id),
-                            self.jobs_df["Inv No"],
-                        )
-                        self.jobs_df["TotalCost"] = np.where(
-                            self.jobs_df["id"] == j_id,
-                            total_cost,
-                            self.jobs_df["TotalCost"],
-                        )
-                        self.jobs_df["Material"] = np.where(
-                            self.jobs_df["id"] == j_id,
-                            material_change,
-                            self.jobs_df["Material"],
-                        )
-                        self.jobs_df["Size"] = np.where(
-                            self.jobs_df["id"] == j_id,
-                            size_change,
-                            self.jobs_df["Size"],
-                        )
-                        self.jobs_df["Proof"] = np.where(
-                            self.jobs_df["id"] == j_id,
-                            "Approved",
-                            self.jobs_df["Proof"],
-                        )
-                        if current_jobtype == "Artwork Only":
-                            self.jobs_df["Status"] = np.where(
-                                self.jobs_df["id"] == j_id,
-                                "Delivered",
-                                self.jobs_df["Status"],
-                            )
-                            self.jobs_df.loc[
-                                self.jobs_df["id"] == j_id, "JobCompletedTime"
-                            ] = self.today
-                        else:
-                            self.jobs_df["Status"] = np.where(
-                                self.jobs_df["id"] == j_id,
-                                new_status,
-                                self.jobs_df["Status"],
-                            )
-                        self.jobs_df.loc[
-                            self.jobs_df["id"] == j_id, "ArtworkCompleteTime"
-                        ] = self.today
+                changes = JobChanges(self.jobs_df, self.id_rows)
+                machine = get_state_machine()
+                illegal = {}
+
+                invoices = {}
+                if new_status == "Machining (Not Processed)":
+                    # Reserved once, for the jobs that can move, so a retry never burns numbers
+                    legal, _ = machine.split(changes, changes.known(task_id)[0], new_status)
+                    if job_id == 0:
+                        allocator = get_id_allocator()
+                        invoices = {j: allocator.reserve("Inv No", self.jobs_df) for j in legal}
+                    else:
+                        invoices = {j: job_id for j in legal}
+                        get_id_allocator().observe("Inv No", job_id)
+
+                def transition(ids):
+                    # Values the screen collected on top of what the transition table sets
+                    values = {}
+                    if new_status == "Machining (Not Processed)":
+                        values = {
+                            "Inv No": [invoices.get(j, 0) for j in ids],
+                            "TotalCost": total_cost,
+                            "Material": material_change,
+                            "Size": size_change,
+                        }
                     elif new_status == "Machining (In Process)":
-                        self.jobs_df["MachineInUse"] = np.where(
-                            self.jobs_df["id"] == j_id,
-                            machine_choice,
-                            self.jobs_df["MachineInUse"],
-                        )
-                        self.jobs_df["Status"] = np.where(
-                            self.jobs_df["id"] == j_id,
-                            new_status,
-                            self.jobs_df["Status"],
-                        )
-                        self.jobs_df.loc[
-                            self.jobs_df["id"] == j_id, "CNCStartTime"
-                        ] = self.today
-                    elif new_status == "At Finishing":
-                        self.jobs_df["Status"] = np.where(
-                            self.jobs_df["id"] == j_id,
-                            new_status,
-                            self.jobs_df["Status"],
-                        )
-                        self.jobs_df.loc[
-                            self.jobs_df["id"] == j_id, "CNCCompleteTime"
-                        ] = self.today
-                    elif new_status == "Ready For QC":
-                        self.jobs_df["Status"] = np.where(
-                            self.jobs_df["id"] == j_id,
-                            new_status,
-                            self.jobs_df["Status"],
-                        )
-                        self.jobs_df.loc[
-                            self.jobs_df["id"] == j_id, "FinishingCompleteTime"
-                        ] = self.today
-                    elif new_status == "Ready for Delivery":
-                        cod_current_status = self.jobs_df.loc[
-                            self.jobs_df["id"] == j_id, "CODStatus"
-                        ].sum()
-                        if cod_current_status == "Not Paid":
-                            new_status = "Waiting payment (COD)"
-
-                        self.jobs_df["Status"] = np.where(
-                            self.jobs_df["id"] == j_id,
-                            new_status,
-                            self.jobs_df["Status"],
-                        )
-                        self.jobs_df.loc[
-                            self.jobs_df["id"] == j_id, "QCCompleteTime"
-                        ] = self.today
-
-                    elif new_status == "Paid":
-                        self.jobs_df["CODStatus"] = np.where(
-                            self.jobs_df["id"] == j_id,
-                            new_status,
-                            self.jobs_df["CODStatus"],
-                        )
-                        self.jobs_df.loc[
-                            self.jobs_df["id"] == j_id, "CODPaymentTime"
-                        ] = self.today
-                        if current_status == "Waiting payment (COD)":
-                            new_status = "Ready for Delivery"
-                            self.jobs_df["Status"] = np.where(
-                                self.jobs_df["id"] == j_id,
-                                new_status,
-                                self.jobs_df["Status"],
-                            )
-
-                    elif new_status == "Delivered":
-                        self.jobs_df["Status"] = np.where(
-                            self.jobs_df["id"] == j_id,
-                            new_status,
-                            self.jobs_df["Status"],
-                        )
-                        self.jobs_df.loc[
-                            self.jobs_df["id"] == j_id, "JobCompletedTime"
-                        ] = self.today
-                    clean_data = [
-                        [clean_value(cell) for cell in row]
-                        for row in self.jobs_df.values.tolist()
-                    ]
-
-                    sheet.update(
-                        [self.jobs_df.columns.tolist()] + clean_data
+                        values = {"MachineInUse": machine_choice}
+                    illegal.update(
+                        machine.apply(changes, ids, new_status, self.today, values)
                     )
-                st.success("Job has been updated")
-                st.cache_data.clear()
-                time.sleep(1)
-                st.rerun()
+
+                # Apply every selected job to the frame, then write once
+                results = changes.apply_all(task_id, transition)
+                results.update(illegal)
+                results.update(changes.commit(self.store, origin=self.origin))
+                self.report_batch(results, "updated")
 
             if new_status in (
                 "Artwork",
@@ -1009,24 +1097,8 @@ class Production:
                 with btn_col2:
                     delete_button = st.button("Delete Job")
                 if delete_button:
-                    for i_id in task_id:
-                        jobs_to_delete = self.jobs_df.loc[
-                            self.jobs_df["id"] == i_id
-                        ].index
-
-                        # Adjust index for Google Sheets (1-based indexing)
-                        rows_to_delete = [
-                            index + 2 for index in jobs_to_delete
-                        ]  # +2 to skip the header row
-
-                        # Delete rows in reverse order to avoid shifting issues
-                        for row in sorted(rows_to_delete, reverse=True):
-                            sheet.delete_rows(row)
-
-                    st.success("Job has been deleted")
-                    st.cache_data.clear()
-                    time.sleep(1)
-                    st.rerun()
+                    results = self.store.delete_jobs(task_id, origin=self.origin)
+                    self.report_batch(results, "deleted")
 
             if new_status in (
                 "At Finishing",
@@ -1037,49 +1109,86 @@ class Production:
                 with btn_col2:
                     reverse_button = st.button("Reverse Status")
                 if reverse_button:
-                    for i_id in task_id:
-                        if new_status == 'At Finishing':
-                            self.jobs_df["Status"] = np.where(
-                                self.jobs_df["id"] == i_id, "Machining (Not Processed)",
-                                self.jobs_df["Status"],
-                            )
-                        elif new_status == 'Ready For QC':
-                            self.jobs_df["Status"] = np.where(
-                                self.jobs_df["id"] == i_id, "Machining (In Process)",
-                                self.jobs_df["Status"],
-                            )
-                        elif new_status == 'Ready for Delivery':
-                            self.jobs_df["Status"] = np.where(
-                                self.jobs_df["id"] == i_id, "At Finishing",
-                                self.jobs_df["Status"],
-                            )
-                        elif new_status == 'Delivered':
-                            self.jobs_df["Status"] = np.where(
-                                self.jobs_df["id"] == i_id, "Ready For QC",
-                                self.jobs_df["Status"],
-                            )
-                        clean_data = [
-                            [clean_value(cell) for cell in row]
-                            for row in self.jobs_df.values.tolist()
-                        ]
-
-                        sheet.update(
-                            [self.jobs_df.columns.tolist()] + clean_data
-                        )
-                    st.success("Job has been reversed")
-                    st.cache_data.clear()
-                    time.sleep(1)
-                    st.rerun()
-                
+                    changes = JobChanges(self.jobs_df, self.id_rows)
+                    illegal = {}
+
+                    def reverse(ids):
+                        illegal.update(get_state_machine().reverse(changes, ids))
+
+                    results = changes.apply_all(task_id, reverse)
+                    results.update(illegal)
+                    results.update(changes.commit(self.store, origin=self.origin))
+                    self.report_batch(results, "reversed")
+
+    def show_grid(self, df, key, view=None):
+        # Read-only grids get this role's columns, dates as text and categories as codes
+        df, ref_data = encode_codes(compact(df, grid_columns(self.displaytype, view)))
+        gb = GridOptionsBuilder.from_dataframe(df)
+        for column, labels in ref_data.items():
+            gb.configure_column(column, refData=labels)
+        hide_helper_columns(gb, df)
+        return AgGrid(df, gridOptions=gb.build(), height=400, key=key)
+
+    def grid_page(self, df, key):
+        # Sort and page on the server so the grid payload stays the same size as history grows
+        pg_col1, pg_col2, pg_col3, pg_col4 = st.columns(4)
+        with pg_col1:
+            sort_by = st.selectbox(
+                "Sort by", [""] + df.columns.tolist(), key=f"{key}_sort"
+            )
+        with pg_col2:
+            order = st.selectbox("Order", ["Ascending", "Descending"], key=f"{key}_order")
+        with pg_col3:
+            page_size = st.selectbox("Rows per page", PAGE_SIZES, index=1, key=f"{key}_size")
+        pages = max(1, -(-len(df) // page_size))
+        if st.session_state.get(f"{key}_page", 1) > pages:
+            # The filter or page size shrank the page count under the current page
+            st.session_state[f"{key}_page"] = pages
+        with pg_col4:
+            page = st.number_input(
+                "Page", min_value=1, max_value=pages, value=1, key=f"{key}_page"
+            )
 
-    def add_job(self, fullname):
+        first = (page - 1) * page_size
+        st.caption(
+            f"Rows {min(first + 1, len(df))}-{min(first + page_size, len(df))} of {len(df)}"
+        )
+        return page_slice(df, page, page_size, sort_by, order == "Ascending")
+
+    def job_value(self, job_id, column, default=""):
+        # Constant-time lookup through the id index
+        if job_id not in self.id_rows or column not in self.jobs_df.columns:
+            return default
+        value = self.jobs_df.iat[self.id_rows[job_id], self.jobs_df.columns.get_loc(column)]
+        return default if pd.isna(value) else value
+
+    def api_usage(self):
+        # Sheets calls made by this server process, to keep an eye on the quota
+        quota = get_sheet_quota()
+        rows = {}
+        for method, stats in quota.stats.summary().items():
+            row = {k: stats[k] for k in ("calls", "errors", "coalesced")}
+            row.update({f"<= {bound}s": n for bound, n in stats["latency"].items()})
+            rows[method] = row
+        with st.sidebar.expander("Sheets API usage"):
+            st.metric(label="Quota used (last minute)", value=f"{quota.used():.0%}")
+            st.dataframe(pd.DataFrame.from_dict(rows, orient="index"))
+
+    def report_batch(self, results, action):
+        # Show the per-job outcome of a batch transition
+        failed = {j_id: error for j_id, error in results.items() if error}
+        done = len(results) - len(failed)
+        if done:
+            st.toast(f"{done} job(s) {action}")
+        # Shown at the top of the page by `display_data` until dismissed
+        st.session_state.setdefault("job_errors", {}).update(
+            {j_id: f"was not {action}: {error}" for j_id, error in failed.items()}
+        )
+
+        get_data_version().bump()
+        st.rerun()
 
-        def clean_value(val):
-            if val is None:
-                return ""
-            if isinstance(val, float) and math.isnan(val):
-                return ""
-            return str(val)
+    def add_job(self, fullname):
 
         # Add a new job
         st.subheader("Add New Job")
@@ -1130,47 +1239,32 @@ class Production:
             job_cost = st.number_input("Job Cost")
 
         if st.button("Add Job"):
-            self.format_data()
-            self.jobs_df["id"] = pd.to_numeric(self.jobs_df["id"])
-            j_list = self.jobs_df["id"].unique().tolist()
-            j_list.sort()
-            wid = int(j_list[-1]) + 1
+            wid = get_id_allocator().reserve("id", self.jobs_df)
 
             if client_type == "COD" and cod_status == "Not Applicable":
                 cod_status = "Not Paid"
 
             new_job = {
-                "id": [wid],
-                "Inv No": [0],
-                "Client": [client],
-                "ClientType": [client_type],
-                "JobName": [jobname],
-                "Size": [size],
-                "Material": [material],
-                "MachineTime": [machine_time],
-                "EstimatedDeliveryDate": [deadline],
-                "JobType": [jobtype],
-                "Status": ["Artwork"],
-                "CODStatus": [cod_status],
-                "DTPOperator": [fullname],
-                "JobAddedTime": [self.today],
-                "JobPriority": [job_priority],
-                "TotalCost": [job_cost],
+                "id": wid,
+                "Inv No": 0,
+                "Client": client,
+                "ClientType": client_type,
+                "JobName": jobname,
+                "Size": size,
+                "Material": material,
+                "MachineTime": machine_time,
+                "EstimatedDeliveryDate": deadline,
+                "JobType": jobtype,
+                "Status": "Artwork",
+                "CODStatus": cod_status,
+                "DTPOperator": fullname,
+                "JobAddedTime": self.today,
+                "JobPriority": job_priority,
+                "TotalCost": job_cost,
             }
-            new_job_df = pd.DataFrame(new_job)
-            self.jobs_df = pd.concat([self.jobs_df, new_job_df], ignore_index=True)
-            clean_data = [
-                [clean_value(cell) for cell in row]
-                for row in self.jobs_df.values.tolist()
-            ]
-
-            sheet.update(
-                [self.jobs_df.columns.tolist()] + clean_data
-            )
-            # self.jobs_df.to_csv("foilwork_jobs.csv", index=False)
-            st.success(f"Job {wid} added!")
-            st.cache_data.clear()
-            time.sleep(1)
+            self.store.append_job(new_job, origin=self.origin)
+            st.toast(f"Job {wid} added!")
+            get_data_version().bump()
             st.rerun()
 
     def overdue_jobs(self):
@@ -0,0 +1,138 @@
+import glob
+import logging
+import os
+import threading
+import time
+
+import pandas as pd
+from gspread.utils import numericise
+
+from job_changes import clean_value
+from job_schema import parse_datetimes, parse_jobs
+
+try:
+    import pyarrow  # noqa: F401
+except ImportError:
+    # Without pyarrow the monthly files are written as CSV instead
+    pyarrow = None
+
+logger = logging.getLogger(__name__)
+
+# Check for jobs to archive this often
+ARCHIVE_INTERVAL = 6 * 60 * 60
+
+
+class JobArchive:
+    """Cold storage for delivered jobs: an archive worksheet plus one local file per month.
+
+    The files are keyed by the month the job was completed, so reports only
+    read the months they cover.
+    """
+
+    def __init__(self, directory="foilworx_archive", worksheet=None):
+        self.directory = directory
+        self.worksheet = worksheet
+        self.suffix = ".csv" if pyarrow is None else ".parquet"
+        self.lock = threading.Lock()
+        # Bumped whenever jobs are archived, so readers can cache on it
+        self.generation = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, month):
+        return os.path.join(self.directory, month + self.suffix)
+
+    def _read(self, path):
+        if path.endswith(".parquet"):
+            return pd.read_parquet(path)
+        return pd.read_csv(path, dtype=str, keep_default_na=False)
+
+    def _write(self, df, path):
+        if path.endswith(".parquet"):
+            df.to_parquet(path, index=False)
+        else:
+            df.to_csv(path, index=False)
+
+    def due(self, jobs_df, older_than_days, now=None):
+        """The delivered jobs completed more than `older_than_days` ago."""
+        now = pd.Timestamp.now() if now is None else now
+        completed = parse_datetimes(jobs_df["JobCompletedTime"])
+        cutoff = now - pd.Timedelta(days=older_than_days)
+        return jobs_df.loc[(jobs_df["Status"] == "Delivered") & (completed < cutoff)]
+
+    def archive(self, store, older_than_days, now=None):
+        """Moves old delivered jobs out of `store` and returns how many moved."""
+        with self.lock:
+            jobs = self.due(store.refresh(), older_than_days, now)
+            if jobs.empty:
+                return 0
+            job_ids = jobs["id"].tolist()
+            # Everything is kept as text, like the sheet, and typed again on read
+            jobs = jobs.apply(lambda column: column.map(clean_value))
+
+            # Local files first, then the sheet, and only then the live rows go
+            months = parse_datetimes(jobs["JobCompletedTime"]).dt.strftime("%Y-%m")
+            for month, part in jobs.groupby(months):
+                path = self._path(month)
+                if os.path.exists(path):
+                    part = pd.concat([self._read(path), part], ignore_index=True)
+                self._write(part.drop_duplicates("id", keep="last"), path)
+
+            if self.worksheet is not None:
+                self._append_sheet(jobs)
+
+            self.generation += 1
+            results = store.delete_jobs(job_ids)
+            failed = {job_id: error for job_id, error in results.items() if error}
+            for job_id, error in failed.items():
+                logger.warning("Archived job %s was not removed from the live sheet: %s", job_id, error)
+            return len(results) - len(failed)
+
+    def _append_sheet(self, jobs):
+        header = self.worksheet.row_values(1)
+        if not header:
+            header = jobs.columns.tolist()
+            self.worksheet.append_rows([header])
+        else:
+            # A retry after a crash must not add the same jobs twice
+            archived = set(self.worksheet.col_values(header.index("id") + 1)[1:])
+            jobs = jobs.loc[~jobs["id"].isin(archived)]
+        rows = [[job.get(column, "") for column in header] for job in jobs.to_dict("records")]
+        if rows:
+            self.worksheet.append_rows(rows)
+
+    def load(self, since=None):
+        """Archived jobs completed in or after the month of `since` (all of them if `None`)."""
+        first = None if since is None else pd.Timestamp(since).strftime("%Y-%m")
+        parts = [
+            self._read(path)
+            for path in sorted(glob.glob(os.path.join(self.directory, "*" + self.suffix)))
+            if first is None or os.path.basename(path)[:7] >= first
+        ]
+        if not parts:
+            return pd.DataFrame()
+        # Same shape as a sheet read: numbers as numbers, then typed like the live jobs
+        df = pd.concat(parts, ignore_index=True).astype(object)
+        return parse_jobs(df.apply(lambda column: column.map(numericise)))
+
+
+class ArchiveWorker:
+    """Runs `archive` in the background every `interval` seconds."""
+
+    def __init__(self, archive, store, version, older_than_days, interval=ARCHIVE_INTERVAL):
+        self.archive = archive
+        self.store = store
+        self.version = version
+        self.older_than_days = older_than_days
+        self.interval = interval
+
+        self.worker = threading.Thread(target=self._run, name="job-archive", daemon=True)
+        self.worker.start()
+
+    def _run(self):
+        while True:
+            try:
+                if self.archive.archive(self.store, self.older_than_days):
+                    self.version.bump()
+            except Exception:
+                logger.exception("Archiving delivered jobs failed")
+            time.sleep(self.interval)
@@ -0,0 +1,249 @@
+import math
+import threading
+
+import pandas as pd
+from gspread.utils import numericise
+
+from job_schema import REVISION_COLUMN, format_duration
+
+
+def clean_value(val):
+    if val is None or val is pd.NA or val is pd.NaT:
+        return ""
+    if isinstance(val, float) and math.isnan(val):
+        return ""
+    if isinstance(val, pd.Timedelta):
+        return format_duration(val)
+    return str(val)
+
+
+def same_value(old, new):
+    """Returns `True` if a grid value would not change what is stored in the sheet."""
+    if pd.isna(old) and (new is None or new == "" or pd.isna(new)):
+        return True
+    try:
+        return float(old) == float(new)
+    except (TypeError, ValueError):
+        return clean_value(old) == clean_value(new)
+
+
+def assign(df, rows, column, value):
+    try:
+        df.loc[rows, column] = value
+    except (TypeError, ValueError):
+        # Strict dtypes can't hold the new value, so widen the column
+        df[column] = df[column].astype(object)
+        df.loc[rows, column] = value
+
+
+def typed_like(current, values):
+    # Read grid values the way the frame stores `current`
+    if pd.api.types.is_datetime64_any_dtype(current):
+        return pd.to_datetime(values, errors="coerce", format="mixed")
+    if pd.api.types.is_timedelta64_dtype(current):
+        return pd.to_timedelta(values.astype(object).where(values.astype(str) != "", None), errors="coerce")
+    return values
+
+
+def changed_mask(old, new):
+    """Elementwise `not same_value(old, new)` for two aligned series."""
+    old = old.reset_index(drop=True)
+    new = typed_like(old, new.reset_index(drop=True))
+    blank_old = old.isna() | (old.astype(str) == "")
+    blank_new = new.isna() | (new.astype(str) == "")
+    same = blank_old & blank_new
+
+    # Numbers compare as numbers, so 5, 5.0 and "5" are all the same
+    old_num = pd.to_numeric(old.astype(object).where(~blank_old), errors="coerce")
+    new_num = pd.to_numeric(new.astype(object).where(~blank_new), errors="coerce")
+    same |= (old_num == new_num).fillna(False).astype(bool)
+
+    if pd.api.types.is_datetime64_any_dtype(old) or pd.api.types.is_timedelta64_dtype(old):
+        same |= (old == new).fillna(False).astype(bool)
+    else:
+        same |= old.astype(str) == new.astype(str)
+    return (~same).to_numpy(), new
+
+
+def diff_cells(jobs_df, edited, id_rows):
+    """The cells of `edited` that differ from `jobs_df`, as `id, column, old, new` rows."""
+    edited = edited.loc[edited["id"].isin(list(id_rows))]
+    if edited.empty:
+        return pd.DataFrame(columns=["id", "column", "old", "new"])
+    ids = edited["id"].tolist()
+    rows = jobs_df.iloc[[id_rows[job_id] for job_id in ids]]
+
+    parts = []
+    for column in jobs_df.columns.intersection(edited.columns).drop("id", errors="ignore"):
+        mask, new = changed_mask(rows[column], edited[column])
+        if mask.any():
+            parts.append(
+                pd.DataFrame(
+                    {
+                        "id": pd.Series(ids)[mask].tolist(),
+                        "column": column,
+                        "old": rows[column].reset_index(drop=True)[mask].tolist(),
+                        # Typed in text that looks like a number is stored as one, like a sheet read
+                        "new": [
+                            numericise(value) if isinstance(value, str) else value
+                            for value in new[mask].tolist()
+                        ],
+                    }
+                )
+            )
+    if not parts:
+        return pd.DataFrame(columns=["id", "column", "old", "new"])
+    return pd.concat(parts, ignore_index=True)
+
+
+def id_positions(jobs_df):
+    # Job id -> row position, first row wins if an id is repeated
+    ids = jobs_df["id"].tolist()
+    return {
+        job_id: pos
+        for pos, job_id in reversed(list(enumerate(ids)))
+        if not pd.isna(job_id)
+    }
+
+
+class JobChanges:
+    """Records the (id, column) cells a transition touches so only those are written back."""
+
+    def __init__(self, jobs_df, id_rows=None):
+        self.jobs_df = jobs_df
+        self.id_rows = id_positions(jobs_df) if id_rows is None else id_rows
+        self.cells = {}
+        self.original = {}
+        # Row revision each touched job had in the frame the change was made on
+        self.revisions = {}
+
+    def labels(self, job_ids):
+        return self.jobs_df.index[[self.id_rows[job_id] for job_id in job_ids]]
+
+    def values(self, job_ids, column):
+        """Current values of `column` for `job_ids`, in the same order."""
+        if column not in self.jobs_df.columns:
+            return [None] * len(job_ids)
+        return self.jobs_df.loc[self.labels(job_ids), column].tolist()
+
+    def set(self, job_id, column, value):
+        self.set_many([job_id], {column: value})
+
+    def set_many(self, job_ids, values):
+        """Sets `{column: value}` on every job in one assignment per column.
+
+        A value can also be a list with one entry per job.
+        """
+        job_ids = list(job_ids)
+        if not job_ids:
+            return
+        labels = self.labels(job_ids)
+        for job_id, rev in zip(job_ids, self.values(job_ids, REVISION_COLUMN)):
+            self.revisions.setdefault(job_id, rev)
+        for column, value in values.items():
+            for job_id, old in zip(job_ids, self.values(job_ids, column)):
+                self.original.setdefault((job_id, column), old)
+            assign(self.jobs_df, labels, column, value)
+
+            per_job = value if isinstance(value, list) else [value] * len(job_ids)
+            for job_id, job_value in zip(job_ids, per_job):
+                self.cells[(job_id, column)] = job_value
+
+    def rollback(self, job_ids, before):
+        # Restore the cells these jobs touched since `before` was taken
+        job_ids = set(job_ids)
+        for key in [k for k in self.cells if k[0] in job_ids]:
+            if key in before:
+                value = before[key]
+                self.cells[key] = value
+            else:
+                value = self.original.pop(key)
+                del self.cells[key]
+            assign(self.jobs_df, self.labels([key[0]]), key[1], value)
+
+    def known(self, job_ids):
+        # Split ids into those in the frame and per-job errors for the rest
+        found = [job_id for job_id in job_ids if job_id in self.id_rows]
+        missing = {
+            job_id: f"job {job_id} is no longer in the store"
+            for job_id in job_ids
+            if job_id not in self.id_rows
+        }
+        return found, missing
+
+    def apply_batch(self, job_ids, transition):
+        """Applies `transition` to every job, rolling back only the jobs that fail."""
+        found, results = self.known(job_ids)
+        for job_id in found:
+            before = dict(self.cells)
+            try:
+                transition([job_id])
+                results[job_id] = None
+            except Exception as e:
+                self.rollback([job_id], before)
+                results[job_id] = str(e)
+        return results
+
+    def apply_all(self, job_ids, transition):
+        """Applies `transition` to all jobs at once.
+
+        If the vectorized step fails it is undone and retried one job at a
+        time, so a bad row doesn't cancel the rest.
+        """
+        found, results = self.known(job_ids)
+        before = dict(self.cells)
+        try:
+            transition(found)
+        except Exception:
+            self.rollback(found, before)
+            results.update(self.apply_batch(found, transition))
+        else:
+            results.update({job_id: None for job_id in found})
+        return results
+
+    def apply_diff(self, diff):
+        """Sets the cells of a `diff_cells` frame, one assignment per column."""
+        for column, part in diff.groupby("column", sort=False):
+            self.set_many(part["id"].tolist(), {column: part["new"].tolist()})
+
+    def commit(self, store, origin=None):
+        """Writes the recorded cells and returns `{id: error}` for jobs someone else changed first."""
+        conflicts = {}
+        if self.cells:
+            touched = {job_id for job_id, _ in self.cells}
+            conflicts = store.update_cells(
+                dict(self.cells),
+                base={k: v for k, v in self.original.items() if k in self.cells},
+                revisions={j: r for j, r in self.revisions.items() if j in touched},
+                origin=origin,
+            )
+        self.cells.clear()
+        self.original.clear()
+        self.revisions.clear()
+        return conflicts or {}
+
+
+class IdAllocator:
+    """Hands out job ids and invoice numbers from a cached high-water mark."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.marks = {}
+
+    def seed(self, column, jobs_df):
+        # Only scans the column the first time it is asked for
+        if column not in self.marks:
+            values = pd.to_numeric(jobs_df[column], errors="coerce")
+            self.marks[column] = 0 if values.isna().all() else int(values.max())
+
+    def observe(self, column, value):
+        # Keep the mark above numbers that were entered by hand
+        with self.lock:
+            if column in self.marks and int(value) > self.marks[column]:
+                self.marks[column] = int(value)
+
+    def reserve(self, column, jobs_df):
+        with self.lock:
+            self.seed(column, jobs_df)
+            self.marks[column] += 1
+            return self.marks[column]
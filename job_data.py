@@ -0,0 +1,290 @@
+import logging
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from job_changes import id_positions
+from job_schema import parse_jobs
+
+logger = logging.getLogger(__name__)
+
+
+class ChangeBus:
+    """Sequence number sessions watch to learn that the jobs changed.
+
+    Published on every write in this process and whenever the poller finds
+    edits made straight in the sheet.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.seq = 0
+
+    def publish(self):
+        with self.lock:
+            self.seq += 1
+            return self.seq
+
+
+class DataVersion:
+    """Counter bumped on every job write. Cached job snapshots are keyed by it."""
+
+    def __init__(self, bus=None):
+        self.lock = threading.Lock()
+        self.value = 0
+        self.bus = bus
+
+    def bump(self):
+        with self.lock:
+            self.value += 1
+            value = self.value
+        if self.bus is not None:
+            self.bus.publish()
+        return value
+
+
+class SnapshotPoller:
+    """Keeps the latest typed jobs frame for every session, refreshed by one background thread.
+
+    Snapshots are keyed `(data version, poll number)`. A poll that finds
+    nothing new keeps the old key, so the caches built on it stay warm.
+    With a `disk` snapshot a new process serves the last saved frame straight
+    away and reconciles with the store in the background.
+    """
+
+    def __init__(self, store, version, interval, keep=4, bus=None, pace=None, disk=None):
+        self.store = store
+        self.version = version
+        self.interval = interval
+        self.keep = keep
+        self.bus = bus
+        # Maps the base interval to the one to wait now, e.g. longer when quota is short
+        self.pace = pace
+        self.disk = disk
+        self.lock = threading.Lock()
+        self.poll_lock = threading.Lock()
+        self.polls = 0
+        self.key = None
+        self.frames = {}
+        # Last frame as the store returned it, to tell whether a poll found anything new
+        self.raw = None
+
+        reconcile = False
+        if disk is not None:
+            frame, saved_at = disk.load()
+            if frame is not None:
+                logger.info("Serving jobs saved %.0fs ago until the store is read", time.time() - saved_at)
+                self.key = (version.value, 0)
+                self.frames[self.key] = frame
+                reconcile = True
+
+        self.worker = threading.Thread(
+            target=self._run, args=(reconcile,), name="snapshot-poller", daemon=True
+        )
+        self.worker.start()
+
+    def _run(self, reconcile):
+        while True:
+            if not reconcile:
+                time.sleep(self.interval if self.pace is None else self.pace(self.interval))
+            reconcile = False
+            try:
+                self.poll()
+            except Exception:
+                logger.exception("Snapshot poll failed")
+
+    def poll(self, stale_only=False, full=False):
+        # One poll at a time, and the store is read outside `lock` so readers never wait on it.
+        # `full` reads every row again, for edits an incremental sync can't see
+        with self.poll_lock:
+            version = self.version.value
+            with self.lock:
+                key, known = self.key, self.raw
+                current = self.frames.get(key)
+            if stale_only and key is not None and key[0] == version:
+                # Another poll caught up while this one waited
+                return key
+
+            raw = self.store.load() if full else self.store.refresh()
+            if key is not None and key[0] == version:
+                if known is not None and known.equals(raw):
+                    return key
+            # Typed here, off the request path, once per new frame
+            frame = parse_jobs(raw)
+            if key is not None and key[0] == version and known is None:
+                # The frame loaded from disk may still be current
+                if current.equals(frame):
+                    with self.lock:
+                        self.raw = raw
+                    return key
+
+            if self.bus is not None and key is not None and key[0] == version:
+                # Nobody here wrote this, so it was edited in the sheet
+                self.bus.publish()
+            with self.lock:
+                self.polls += 1
+                key = self.key = (version, self.polls)
+                self.frames[key] = frame
+                self.raw = raw
+                # Sessions may still be rendering the last few snapshots
+                while len(self.frames) > self.keep:
+                    del self.frames[next(iter(self.frames))]
+            if self.disk is not None:
+                try:
+                    self.disk.save(frame, key)
+                except Exception:
+                    logger.exception("Saving the jobs snapshot failed")
+            return key
+
+    def latest(self):
+        with self.lock:
+            key = self.key
+        # A write made in this process shows up straight away, not on the next tick
+        if key is None or key[0] != self.version.value:
+            key = self.poll(stale_only=True)
+        return key
+
+    def frame(self, key):
+        with self.lock:
+            return self.frames.get(key, self.frames[self.key])
+
+
+class JobIndex:
+    """Row positions of the jobs frame per value of a few columns, built in one pass each."""
+
+    def __init__(self, jobs_df, columns=("Status", "DTPOperator", "CODStatus")):
+        self.size = len(jobs_df)
+        self.id_rows = id_positions(jobs_df)
+        self.groups = {
+            column: jobs_df.groupby(column, sort=False, dropna=False).indices
+            for column in columns
+            if column in jobs_df.columns
+        }
+
+    def rows(self, **filters):
+        """Sorted row positions matching every `column=value` (or list of values) filter."""
+        result = None
+        for column, values in filters.items():
+            if isinstance(values, str) or not hasattr(values, "__iter__"):
+                values = [values]
+            groups = self.groups[column]
+            parts = [groups[value] for value in values if value in groups]
+            positions = np.sort(np.concatenate(parts)) if parts else np.empty(0, dtype=int)
+            result = (
+                positions
+                if result is None
+                else np.intersect1d(result, positions, assume_unique=True)
+            )
+        return np.arange(self.size) if result is None else result
+
+    def count(self, **filters):
+        return len(self.rows(**filters))
+
+
+class FilterIndex:
+    """Categorical codes of the All Jobs search columns, with their sorted option lists.
+
+    A column's rows matching a set of values is one table lookup over its
+    codes, so each filter costs a single pass and filters combine with `&`.
+    """
+
+    def __init__(self, jobs_df, columns=("DTPOperator", "Client", "JobName", "Material")):
+        self.size = len(jobs_df)
+        self.codes = {}
+        self.options = {}
+        self.lookup = {}
+        for column in columns:
+            if column not in jobs_df.columns:
+                continue
+            values = jobs_df[column]
+            text = values.astype(object).where(values.notna(), "").astype(str)
+            codes, labels = pd.factorize(text, sort=True)
+            self.codes[column] = codes
+            self.options[column] = labels.tolist()
+            self.lookup[column] = {label: code for code, label in enumerate(self.options[column])}
+
+    def mask(self, **selected):
+        """Boolean row mask for `column=[values]` filters. A column with every value selected is skipped."""
+        mask = np.ones(self.size, dtype=bool)
+        for column, values in selected.items():
+            if len(values) == len(self.options[column]):
+                continue
+            wanted = np.zeros(len(self.options[column]) + 1, dtype=bool)
+            wanted[[self.lookup[column][v] for v in values if v in self.lookup[column]]] = True
+            # Codes of -1 (none) land on the spare last slot, which is never wanted
+            mask &= wanted[self.codes[column]]
+        return mask
+
+
+class RevenueRollup:
+    """Running revenue total per day, so the total over any date range is two lookups.
+
+    The same running totals are kept per value of each `by` column.
+    """
+
+    def __init__(self, jobs_df, by=("ClientType", "DTPOperator")):
+        if jobs_df.empty:
+            # e.g. nothing archived yet
+            jobs_df = pd.DataFrame(columns=["JobAddedTime", "TotalCost"])
+        days = pd.to_datetime(jobs_df["JobAddedTime"], errors="coerce").dt.normalize()
+        cost = pd.to_numeric(jobs_df["TotalCost"], errors="coerce").fillna(0)
+        valid = days.notna()
+        days, cost = days[valid], cost[valid]
+
+        daily = cost.groupby(days).sum().sort_index()
+        self.days = daily.index.values
+        # One leading zero so a range total is always cumulative[j] - cumulative[i]
+        self.cumulative = np.concatenate([[0], daily.cumsum().values])
+
+        self.breakdowns = {}
+        for column in by:
+            if column not in jobs_df.columns:
+                continue
+            table = (
+                cost.groupby([days, jobs_df.loc[valid, column].astype(str)])
+                .sum()
+                .unstack(fill_value=0)
+                .reindex(daily.index, fill_value=0)
+            )
+            running = np.vstack([np.zeros(len(table.columns)), table.cumsum().values])
+            self.breakdowns[column] = (table.columns, running)
+
+    def _span(self, start, end):
+        # Positions of the first day on or after `start` and the first one after `end`
+        start = np.datetime64(pd.Timestamp(start).normalize(), "ns")
+        end = np.datetime64(pd.Timestamp(end).normalize(), "ns")
+        return (
+            np.searchsorted(self.days, start, side="left"),
+            np.searchsorted(self.days, end, side="right"),
+        )
+
+    def total(self, start, end):
+        """Revenue of the jobs added from `start` to `end`, both days included."""
+        i, j = self._span(start, end)
+        return self.cumulative[j] - self.cumulative[i] if j > i else 0
+
+    def breakdown(self, column, start, end):
+        """The same total split by the values of `column`, as a series."""
+        values, running = self.breakdowns[column]
+        i, j = self._span(start, end)
+        totals = running[j] - running[i] if j > i else np.zeros(len(values))
+        return pd.Series(totals, index=values)
+
+
+def machine_occupancy(jobs_df, machines):
+    """`{machine: (job count, invoice text)}` for the jobs being machined, in one groupby."""
+    in_process = jobs_df.loc[jobs_df["Status"] == "Machining (In Process)"]
+    invoices = in_process.groupby("MachineInUse", sort=False)["Inv No"].agg(list)
+    occupancy = {}
+    for machine in machines:
+        job_list = invoices.get(machine, [])
+        if len(job_list) == 1:
+            text = str(job_list[0])
+        elif len(job_list) > 1:
+            text = "".join(" | " + str(inv) for inv in job_list)
+        else:
+            text = None
+        occupancy[machine] = (len(job_list), text)
+    return occupancy
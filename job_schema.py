@@ -0,0 +1,96 @@
+import pandas as pd
+
+# Timestamp columns in the jobs sheet
+DATETIME_COLUMNS = [
+    "JobAddedTime",
+    "EstimatedDeliveryDate",
+    "ArtworkCompleteTime",
+    "CODPaymentTime",
+    "CNCStartTime",
+    "CNCCompleteTime",
+    "FinishingCompleteTime",
+    "ProofApprovalTime",
+    "QCCompleteTime",
+    "JobCompletedTime",
+]
+
+# Formats found in the sheet, most common first. The app writes the first one,
+# older rows were typed in by hand with the slashed ones.
+DATETIME_FORMATS = [
+    "%Y-%m-%d %H:%M:%S",
+    "%Y/%m/%d %H:%M",
+    "%Y/%m/%d %H:%M:%S",
+    "%Y-%m-%d %H:%M",
+    "%Y-%m-%d",
+    "%Y/%m/%d",
+]
+
+INTEGER_COLUMNS = ["id", "Inv No"]
+
+# Stored as a timedelta so the column stays numeric
+DURATION_COLUMNS = ["MachineTime"]
+
+BLANKS = ["", "NaT", "nan", "None", "<NA>"]
+
+# Last-modified stamp the app keeps on every sheet row it writes
+REVISION_COLUMN = "Revision"
+
+
+def parse_datetimes(values):
+    text = values.astype(object).where(values.notna(), "").astype(str).str.strip()
+    parsed = pd.Series(pd.NaT, index=values.index, dtype="datetime64[ns]")
+    todo = ~text.isin(BLANKS)
+    for fmt in DATETIME_FORMATS:
+        if not todo.any():
+            break
+        attempt = pd.to_datetime(text[todo], format=fmt, errors="coerce").dropna()
+        parsed.loc[attempt.index] = attempt
+        todo.loc[attempt.index] = False
+    if todo.any():
+        # Anything left over gets the slow per-value guess
+        parsed.loc[todo] = pd.to_datetime(text[todo], format="mixed", errors="coerce")
+    return parsed
+
+
+def parse_integers(values):
+    numbers = pd.to_numeric(
+        values.astype(object).where(~values.astype(str).isin(BLANKS)), errors="coerce"
+    )
+    return numbers.round().astype("Int64")
+
+
+def parse_durations(values):
+    text = values.astype(object).where(values.notna(), "").astype(str).str.strip()
+    return pd.to_timedelta(text.where(~text.isin(BLANKS)), errors="coerce")
+
+
+def parse_value(column, value):
+    """Types one stored value the way `parse_jobs` types its column."""
+    for columns, parse in (
+        (DATETIME_COLUMNS, parse_datetimes),
+        (INTEGER_COLUMNS, parse_integers),
+        (DURATION_COLUMNS, parse_durations),
+    ):
+        if column in columns:
+            return parse(pd.Series([value], dtype=object)).iloc[0]
+    return value
+
+
+def parse_jobs(df):
+    """Returns a typed copy of the jobs frame as it comes from the store."""
+    df = df.copy()
+    for column in DATETIME_COLUMNS:
+        if column in df.columns:
+            df[column] = parse_datetimes(df[column])
+    for column in INTEGER_COLUMNS:
+        if column in df.columns:
+            df[column] = parse_integers(df[column])
+    for column in DURATION_COLUMNS:
+        if column in df.columns:
+            df[column] = parse_durations(df[column])
+    return df
+
+
+def format_duration(value):
+    seconds = int(value.total_seconds())
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
@@ -0,0 +1,59 @@
+import json
+import logging
+import os
+import time
+
+from gspread.utils import numericise
+
+from job_changes import clean_value
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:
+    # Without pyarrow every start loads from the store
+    pa = None
+
+logger = logging.getLogger(__name__)
+
+
+class DiskSnapshot:
+    """The typed jobs frame kept in an Arrow file, so a new process can serve it at once."""
+
+    def __init__(self, path="foilworx_jobs.arrow"):
+        self.path = path
+        self.enabled = pa is not None
+
+    def save(self, jobs_df, key):
+        if not self.enabled:
+            return
+        # Typed columns go in as they are; mixed text/number columns as text, like the sheet
+        df = jobs_df.copy()
+        mixed = [column for column in df.columns if df[column].dtype == object]
+        for column in mixed:
+            df[column] = df[column].map(clean_value)
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        meta = json.dumps({"key": list(key), "saved_at": time.time(), "mixed": mixed})
+        table = table.replace_schema_metadata(
+            {**(table.schema.metadata or {}), b"foilworx": meta.encode()}
+        )
+        # Write beside the old file and swap, so a reader never sees half a file
+        tmp = self.path + ".tmp"
+        feather.write_feather(table, tmp, compression="uncompressed")
+        os.replace(tmp, self.path)
+
+    def load(self):
+        """Returns `(jobs_df, saved_at)`, or `(None, None)` when there is nothing usable."""
+        if not self.enabled or not os.path.exists(self.path):
+            return None, None
+        try:
+            # Uncompressed Arrow files are mapped, not read
+            table = feather.read_table(self.path, memory_map=True)
+            meta = json.loads(table.schema.metadata[b"foilworx"])
+            df = table.to_pandas()
+        except Exception:
+            logger.exception("Ignoring unreadable jobs snapshot %s", self.path)
+            return None, None
+        for column in meta["mixed"]:
+            df[column] = df[column].astype(object).map(numericise)
+        return df, meta["saved_at"]
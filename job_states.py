@@ -0,0 +1,134 @@
+import pandas as pd
+
+# Actions offered by the status screens. Each one moves jobs from `sources`
+# (None means any status) to `target`, stamping the target's timestamp column.
+# A detour `(column, value, target, stamp)` sends the jobs whose `column` equals
+# `value` to `target` instead, stamping the target's timestamp when `stamp` is set.
+TRANSITIONS = {
+    "Waiting Approval": {
+        "sources": ["Artwork", "Artwork Only"],
+        "target": "Waiting Approval",
+    },
+    "Machining (Not Processed)": {
+        "sources": ["Waiting Approval"],
+        "target": "Machining (Not Processed)",
+        "values": {"Proof": "Approved"},
+        # Artwork only jobs are done once the proof is approved
+        "detours": [("JobType", "Artwork Only", "Delivered", True)],
+    },
+    "Machining (In Process)": {
+        "sources": ["Machining (Not Processed)"],
+        "target": "Machining (In Process)",
+    },
+    "At Finishing": {
+        "sources": ["Machining (In Process)"],
+        "target": "At Finishing",
+    },
+    "Ready For QC": {
+        "sources": ["At Finishing"],
+        "target": "Ready For QC",
+    },
+    "Ready for Delivery": {
+        "sources": ["Ready For QC"],
+        "target": "Ready for Delivery",
+        # COD jobs wait for payment before going out
+        "detours": [("CODStatus", "Not Paid", "Waiting payment (COD)", True)],
+    },
+    "Paid": {
+        "sources": None,
+        "target": None,
+        "stamp": "CODPaymentTime",
+        "values": {"CODStatus": "Paid"},
+        # Paying only releases the job, its QC time stays as it was
+        "detours": [("Status", "Waiting payment (COD)", "Ready for Delivery", False)],
+    },
+    "Delivered": {
+        "sources": ["Ready for Delivery"],
+        "target": "Delivered",
+    },
+}
+
+
+class JobStateMachine:
+    """Applies status transitions to a batch of jobs through `JobChanges`."""
+
+    def __init__(self, statuses, transitions=TRANSITIONS):
+        statuses = statuses.fillna("")
+        self.statuses = statuses["Status"].tolist()
+        self.stamps = {
+            row.Status: row.TimestampColumn
+            for row in statuses.itertuples()
+            if row.TimestampColumn
+        }
+        self.previous = {
+            row.Status: row.PreviousStatus
+            for row in statuses.itertuples()
+            if row.PreviousStatus
+        }
+        self.transitions = transitions
+
+    @classmethod
+    def from_csv(cls, path):
+        return cls(pd.read_csv(path, dtype=str))
+
+    def split(self, changes, job_ids, action):
+        """Returns the jobs `action` may move and `{id: error}` for the rest."""
+        sources = self.transitions[action]["sources"]
+        legal = []
+        errors = {}
+        for job_id, status in zip(job_ids, changes.values(job_ids, "Status")):
+            if sources is None or status in sources:
+                legal.append(job_id)
+            else:
+                errors[job_id] = f"can't go from {status} to {action}"
+        return legal, errors
+
+    def apply(self, changes, job_ids, action, now, values=None):
+        """Moves `job_ids` through `action` and returns `{id: error}` for illegal moves."""
+        rule = self.transitions[action]
+        legal, errors = self.split(changes, job_ids, action)
+        keep = [pos for pos, job_id in enumerate(job_ids) if job_id not in errors]
+
+        # Per-job value lists only keep the entries of the legal jobs
+        values = {
+            column: [value[pos] for pos in keep] if isinstance(value, list) else value
+            for column, value in (values or {}).items()
+        }
+
+        # Work out the detours before anything is written
+        detoured = {}
+        for column, value, target, stamp_target in rule.get("detours", []):
+            for job_id, current_value in zip(legal, changes.values(legal, column)):
+                if current_value == value and job_id not in detoured:
+                    detoured[job_id] = (target, stamp_target)
+
+        stamp = rule.get("stamp") or self.stamps.get(rule["target"])
+        updates = {**rule.get("values", {}), **values}
+        if stamp:
+            updates[stamp] = now
+        if rule["target"] is not None:
+            updates["Status"] = rule["target"]
+        changes.set_many(legal, updates)
+
+        for target, stamp_target in set(detoured.values()):
+            ids = [job_id for job_id in legal if detoured.get(job_id) == (target, stamp_target)]
+            detour_updates = {"Status": target}
+            if stamp_target and self.stamps.get(target):
+                detour_updates[self.stamps[target]] = now
+            changes.set_many(ids, detour_updates)
+        return errors
+
+    def reverse(self, changes, job_ids):
+        """Moves jobs back one status and clears the timestamp of the status they leave."""
+        current = changes.values(job_ids, "Status")
+        errors = {}
+        for status in set(current):
+            ids = [job_id for job_id, s in zip(job_ids, current) if s == status]
+            if status not in self.previous:
+                errors.update({job_id: f"{status} can't be reversed" for job_id in ids})
+                continue
+            updates = {"Status": self.previous[status]}
+            if self.stamps.get(status):
+                updates[self.stamps[status]] = pd.NaT
+            changes.set_many(ids, updates)
+        return errors
@@ -0,0 +1,470 @@
+import math
+import os
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+from gspread.utils import a1_to_rowcol, numericise_all, rowcol_to_a1
+
+from job_changes import assign, clean_value, same_value
+from job_schema import REVISION_COLUMN, parse_value
+
+# Columns the app relies on that older exports of the sheet don't have
+SEED_DEFAULTS = {"JobType": "Normal", "QCCompleteTime": ""}
+
+INDEXED_COLUMNS = ["Status", "DTPOperator", "EstimatedDeliveryDate"]
+
+# Incremental syncs can't see hand edits made in the sheet, so reload fully this often
+FULL_RELOAD_SECONDS = 600
+
+
+class JobStore:
+    """Where the jobs table lives. `Production` only talks to this interface."""
+
+    def load(self):
+        """Returns every job as a frame in the same shape as `get_all_records`."""
+        raise NotImplementedError
+
+    def refresh(self):
+        """Returns the current jobs, reusing whatever the store already has."""
+        return self.load()
+
+    def update_cells(self, cells, base=None, revisions=None, origin=None):
+        """Writes a `{(id, column): value}` mapping.
+
+        `base` holds the values the change was made against and `revisions`
+        the row revision of each job at that time. Stores that can check them
+        rebase the write onto rows that moved since, and return `{id: error}`
+        for the jobs whose cells someone else changed first. `origin` names
+        the session making the change, for stores that only check later.
+        """
+        raise NotImplementedError
+
+    def take_rejected(self, origin):
+        """Pops `{id: error}` for writes by `origin` that were dropped after the call returned."""
+        return {}
+
+    def append_job(self, job, origin=None):
+        """Adds one job given as a `{column: value}` mapping."""
+        raise NotImplementedError
+
+    def append_jobs(self, jobs):
+        for job in jobs:
+            self.append_job(job)
+
+    def delete_jobs(self, job_ids, origin=None):
+        """Deletes jobs by id and returns `{id: None or error}`."""
+        raise NotImplementedError
+
+
+def row_ranges(rows):
+    # Group sheet row numbers into contiguous (first, last) ranges
+    ranges = []
+    for row in sorted(set(rows)):
+        if ranges and row == ranges[-1][1] + 1:
+            ranges[-1][1] = row
+        else:
+            ranges.append([row, row])
+    return [tuple(r) for r in ranges]
+
+
+def revision():
+    return time.time_ns() // 1_000_000
+
+
+def rebase(cells, base, live):
+    """Splits `cells` into those still safe to write and `{id: error}` for the rest.
+
+    `live` holds the stored `{column: value}` of each job that moved since
+    `base` was read. A cell is kept if nobody else changed it, or they changed
+    it to the same value.
+    """
+    keep = {}
+    clashes = {}
+    for (job_id, column), value in cells.items():
+        if job_id not in live:
+            keep[(job_id, column)] = value
+            continue
+        # Stored text is typed like the frame the base came from, so "2024/10/20" matches a Timestamp
+        current = parse_value(column, live[job_id].get(column, ""))
+        if (
+            (job_id, column) not in base
+            or same_value(base[(job_id, column)], current)
+            or same_value(current, value)
+        ):
+            keep[(job_id, column)] = value
+        else:
+            clashes.setdefault(job_id, []).append(column)
+    errors = {
+        job_id: "changed by someone else meanwhile: " + ", ".join(columns)
+        for job_id, columns in clashes.items()
+    }
+    # A job is written all or nothing
+    keep = {k: v for k, v in keep.items() if k[0] not in errors}
+    return keep, errors
+
+
+class GoogleSheetStore(JobStore):
+    def __init__(self, worksheet):
+        self.worksheet = worksheet
+        self.header = None
+        # Job id (as text) -> sheet row numbers
+        self.rows = None
+        # Last frame read from the sheet, kept for incremental syncs
+        self.frame = None
+        self.loaded_at = 0
+        self.lock = threading.Lock()
+
+    def _index(self, sheet_ids):
+        rows = {}
+        for pos, job_id in enumerate(sheet_ids):
+            rows.setdefault(str(job_id), []).append(pos + 2)  # +2 to skip the header row
+        self.rows = rows
+
+    def _header(self):
+        if self.header is None:
+            self.header = self.worksheet.row_values(1)
+        return self.header
+
+    def _sheet_ids(self):
+        return self.worksheet.col_values(self._header().index("id") + 1)[1:]
+
+    def _add_columns(self, columns):
+        # Columns that don't exist in the sheet yet get a header cell
+        header = self._header()
+        data = []
+        for column in columns:
+            if column not in header:
+                header.append(column)
+                data.append(
+                    {"range": rowcol_to_a1(1, len(header)), "values": [[column]]}
+                )
+        return data
+
+    def load(self):
+        with self.lock:
+            df = pd.DataFrame(self.worksheet.get_all_records())
+            self.header = df.columns.tolist()
+            self._index(df["id"].tolist())
+            self.frame = df
+            self.loaded_at = time.monotonic()
+            return df.copy()
+
+    def refresh(self):
+        if (
+            self.frame is None
+            or REVISION_COLUMN not in self.frame.columns
+            or time.monotonic() - self.loaded_at > FULL_RELOAD_SECONDS
+        ):
+            return self.load()
+
+        with self.lock:
+            frame = self.frame
+            header = frame.columns.tolist()
+            id_col = rowcol_to_a1(1, header.index("id") + 1).rstrip("1")
+            rev_col = rowcol_to_a1(1, header.index(REVISION_COLUMN) + 1).rstrip("1")
+
+            # Only the header, id and revision columns come down in full
+            live_header, ids, revs = self.worksheet.batch_get(
+                ["1:1", f"{id_col}2:{id_col}", f"{rev_col}2:{rev_col}"]
+            )
+            live_header = live_header[0] if live_header else []
+            ids = [row[0] if row else "" for row in ids]
+            revs = [row[0] if row else "" for row in revs]
+            revs += [""] * (len(ids) - len(revs))
+
+        known_ids = [str(job_id) for job_id in frame["id"]]
+        if live_header != header or ids[: len(known_ids)] != known_ids:
+            # Rows were deleted, moved or the columns changed
+            return self.load()
+
+        with self.lock:
+            known_revs = [clean_value(rev) for rev in frame[REVISION_COLUMN]]
+            changed = [
+                pos + 2
+                for pos, rev in enumerate(revs)
+                if pos >= len(known_revs) or rev != known_revs[pos]
+            ]
+            if changed:
+                last_col = rowcol_to_a1(1, len(header)).rstrip("1")
+                ranges = row_ranges(changed)
+                blocks = self.worksheet.batch_get(
+                    [f"A{first}:{last_col}{last}" for first, last in ranges]
+                )
+
+                frame = frame.copy()
+                new_rows = []
+                for (first, _), block in zip(ranges, blocks):
+                    for offset, values in enumerate(block):
+                        values = values + [""] * (len(header) - len(values))
+                        record = dict(zip(header, numericise_all(values)))
+                        pos = first - 2 + offset
+                        if pos < len(frame):
+                            for column, value in record.items():
+                                assign(frame, pos, column, value)
+                        else:
+                            new_rows.append(record)
+                if new_rows:
+                    frame = pd.concat([frame, pd.DataFrame(new_rows)], ignore_index=True)
+                self.frame = frame
+                self._index(frame["id"].tolist())
+            return frame.copy()
+
+    def _live_rows(self, job_ids):
+        # Re-read only the rows these jobs are on, in one call
+        header = self._header()
+        last_col = rowcol_to_a1(1, len(header)).rstrip("1")
+        job_ids = [job_id for job_id in job_ids if self.rows.get(str(job_id))]
+        rows = [self.rows[str(job_id)][0] for job_id in job_ids]
+        blocks = self.worksheet.batch_get([f"A{row}:{last_col}{row}" for row in rows])
+        live = {}
+        for job_id, block in zip(job_ids, blocks):
+            values = block[0] if block else []
+            values = values + [""] * (len(header) - len(values))
+            live[job_id] = dict(zip(header, numericise_all(values)))
+        return live
+
+    def _check(self, cells, base, revisions):
+        live = self._live_rows(revisions)
+        errors = {
+            job_id: "no longer in the sheet, refresh and try again"
+            for job_id in revisions
+            if job_id not in live or str(live[job_id].get("id")) != str(job_id)
+        }
+        # Rows whose revision still matches haven't been touched since they were read
+        moved = {
+            job_id: row
+            for job_id, row in live.items()
+            if job_id not in errors
+            and not same_value(revisions[job_id], row.get(REVISION_COLUMN, ""))
+        }
+        cells, clashes = rebase(cells, base or {}, moved)
+        errors.update(clashes)
+        return {k: v for k, v in cells.items() if k[0] not in errors}, errors
+
+    def update_cells(self, cells, base=None, revisions=None, origin=None):
+        if self.rows is None:
+            self._index(self._sheet_ids())
+
+        errors = {}
+        if revisions and REVISION_COLUMN in self._header():
+            cells, errors = self._check(cells, base, revisions)
+
+        # Stamp every touched row so incremental syncs pick it up
+        stamp = revision()
+        cells = dict(cells)
+        for job_id in {job_id for job_id, _ in cells}:
+            cells[(job_id, REVISION_COLUMN)] = stamp
+
+        data = self._add_columns(dict.fromkeys(column for _, column in cells))
+        header = self._header()
+        for (job_id, column), value in cells.items():
+            col = header.index(column) + 1
+            for row in self.rows.get(str(job_id), []):
+                data.append(
+                    {
+                        "range": rowcol_to_a1(row, col),
+                        "values": [[clean_value(value)]],
+                    }
+                )
+        if data:
+            self.worksheet.batch_update(data)
+        return errors
+
+    def append_job(self, job, origin=None):
+        self.append_jobs([job])
+
+    def append_jobs(self, jobs):
+        # A replayed append (after a crash or a timeout that still landed) must not add the job twice
+        sheet_ids = self._sheet_ids()
+        self._index(sheet_ids)
+        existing = set(sheet_ids)
+        jobs = [job for job in jobs if clean_value(job["id"]) not in existing]
+        if not jobs:
+            return
+
+        stamp = revision()
+        jobs = [{**job, REVISION_COLUMN: stamp} for job in jobs]
+        data = self._add_columns([REVISION_COLUMN])
+        if data:
+            self.worksheet.batch_update(data)
+
+        header = self._header()
+        response = self.worksheet.append_rows(
+            [[clean_value(job.get(column)) for column in header] for job in jobs]
+        )
+        updated = response["updates"]["updatedRange"].split("!")[-1]
+        first = a1_to_rowcol(updated.split(":")[0])[0]
+        for offset, job in enumerate(jobs):
+            self.rows.setdefault(str(job["id"]), []).append(first + offset)
+
+    def delete_jobs(self, job_ids, origin=None):
+        # Re-read the id column so rows are matched on the live sheet, not a stale frame
+        sheet_ids = self._sheet_ids()
+        wanted = {str(job_id) for job_id in job_ids}
+        rows = [pos + 2 for pos, job_id in enumerate(sheet_ids) if job_id in wanted]
+
+        # Bottom ranges first so earlier deletes don't shift later ones
+        requests = [
+            {
+                "deleteDimension": {
+                    "range": {
+                        "sheetId": self.worksheet.id,
+                        "dimension": "ROWS",
+                        "startIndex": first - 1,
+                        "endIndex": last,
+                    }
+                }
+            }
+            for first, last in reversed(row_ranges(rows))
+        ]
+        if requests:
+            self.worksheet.spreadsheet.batch_update({"requests": requests})
+        self._index([job_id for job_id in sheet_ids if job_id not in wanted])
+        with self.lock:
+            if self.frame is not None:
+                self.frame = self.frame.loc[
+                    ~self.frame["id"].astype(str).isin(wanted)
+                ].reset_index(drop=True)
+
+        found = {sheet_ids[row - 2] for row in rows}
+        return {
+            job_id: None if str(job_id) in found else "not found in the sheet"
+            for job_id in job_ids
+        }
+
+
+def sql_value(val):
+    # Keep numbers as numbers and blanks as "" like the sheet does
+    if val is None or (isinstance(val, float) and math.isnan(val)):
+        return ""
+    if isinstance(val, (bool, int, float)):
+        return val
+    if hasattr(val, "item") and not isinstance(val, str):
+        return sql_value(val.item())
+    return clean_value(val)
+
+
+def quote(column):
+    return '"' + column.replace('"', '""') + '"'
+
+
+class SQLiteStore(JobStore):
+    """Local jobs table, optionally mirroring every write to another store."""
+
+    def __init__(self, path, seed_csv="foilwork_jobs.csv", mirror=None):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.mirror = mirror
+
+        with self.lock:
+            exists = self.conn.execute(
+                "SELECT name FROM sqlite_master WHERE type='table' AND name='jobs'"
+            ).fetchone()
+        if not exists:
+            if mirror is not None:
+                self.seed(mirror.load())
+            elif os.path.exists(seed_csv):
+                self.seed(pd.read_csv(seed_csv))
+
+    def columns(self):
+        return [row[1] for row in self.conn.execute("PRAGMA table_info(jobs)")]
+
+    def seed(self, df):
+        df = df.copy()
+        if "id" not in df.columns:
+            df.insert(0, "id", range(1, len(df) + 1))
+        for column, default in SEED_DEFAULTS.items():
+            if column not in df.columns:
+                df[column] = default
+
+        columns = [c for c in df.columns if c != "id"]
+        with self.lock, self.conn:
+            self.conn.execute(
+                "CREATE TABLE jobs (id INTEGER PRIMARY KEY, "
+                + ", ".join(f"{quote(c)} DEFAULT ''" for c in columns)
+                + ")"
+            )
+            for column in INDEXED_COLUMNS:
+                if column in columns:
+                    self.conn.execute(
+                        f"CREATE INDEX {quote('ix_' + column)} ON jobs ({quote(column)})"
+                    )
+            self.conn.executemany(
+                f"INSERT INTO jobs ({', '.join(quote(c) for c in df.columns)}) "
+                f"VALUES ({', '.join('?' for _ in df.columns)})",
+                [[sql_value(v) for v in row] for row in df.itertuples(index=False)],
+            )
+
+    def load(self):
+        with self.lock:
+            return pd.read_sql_query("SELECT * FROM jobs ORDER BY rowid", self.conn)
+
+    def _add_columns(self, columns):
+        existing = self.columns()
+        for column in columns:
+            if column not in existing:
+                self.conn.execute(f"ALTER TABLE jobs ADD COLUMN {quote(column)} DEFAULT ''")
+                existing.append(column)
+
+    def update_cells(self, cells, base=None, revisions=None, origin=None):
+        errors = {}
+        with self.lock, self.conn:
+            self._add_columns(dict.fromkeys(column for _, column in cells))
+            if base:
+                # Compare against the stored rows inside the same transaction
+                ids = [sql_value(job_id) for job_id in {job_id for job_id, _ in cells}]
+                cursor = self.conn.execute(
+                    f"SELECT * FROM jobs WHERE id IN ({', '.join('?' for _ in ids)})", ids
+                )
+                columns = [d[0] for d in cursor.description]
+                stored = {row[0]: dict(zip(columns, row)) for row in cursor}
+                live = {
+                    job_id: stored[sql_value(job_id)]
+                    for job_id, _ in cells
+                    if sql_value(job_id) in stored
+                }
+                cells, errors = rebase(cells, base, live)
+            for (job_id, column), value in cells.items():
+                self.conn.execute(
+                    f"UPDATE jobs SET {quote(column)} = ? WHERE id = ?",
+                    (sql_value(value), sql_value(job_id)),
+                )
+        if self.mirror is not None and cells:
+            # The local table is the source of truth, so the mirror takes the write as is
+            self.mirror.update_cells(cells)
+        return errors
+
+    def append_job(self, job, origin=None):
+        with self.lock, self.conn:
+            self._add_columns(job)
+            self.conn.execute(
+                f"INSERT INTO jobs ({', '.join(quote(c) for c in job)}) "
+                f"VALUES ({', '.join('?' for _ in job)})",
+                [sql_value(v) for v in job.values()],
+            )
+        if self.mirror is not None:
+            self.mirror.append_job(job)
+
+    def delete_jobs(self, job_ids, origin=None):
+        ids = [sql_value(job_id) for job_id in job_ids]
+        if not ids:
+            return {}
+        with self.lock, self.conn:
+            found = {
+                row[0]
+                for row in self.conn.execute(
+                    f"SELECT id FROM jobs WHERE id IN ({', '.join('?' for _ in ids)})",
+                    ids,
+                )
+            }
+            self.conn.execute(
+                f"DELETE FROM jobs WHERE id IN ({', '.join('?' for _ in ids)})", ids
+            )
+        if self.mirror is not None:
+            self.mirror.delete_jobs(job_ids)
+        return {
+            job_id: None if sql_value(job_id) in found else "not found in the store"
+            for job_id in job_ids
+        }
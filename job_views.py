@@ -0,0 +1,176 @@
+import pandas as pd
+
+from job_schema import DATETIME_FORMATS, format_duration
+
+DASHBOARD_VIEWS = [
+    "all_artwork_jobs",
+    "proof_approval",
+    "waiting_cod_payment",
+    "ready_for_machine",
+    "cutting_in_progress",
+    "finishing_jobs",
+    "qc_jobs",
+    "delivery_jobs",
+    "delivered_today",
+]
+
+MY_JOBS_VIEWS = [
+    "pending_jobs",
+    "proof_approval",
+    "waiting_cod_payment",
+    "cutting_in_progress",
+    "qc_jobs",
+]
+
+# Views each display type can put on screen
+ROLE_VIEWS = {
+    1: DASHBOARD_VIEWS + ["pending_jobs"],
+    2: MY_JOBS_VIEWS,
+    3: ["ready_for_machine", "cutting_in_progress", "finishing_jobs", "qc_jobs", "delivery_jobs"],
+    5: ["delivery_jobs"],
+    6: DASHBOARD_VIEWS,
+}
+
+
+class LazyView:
+    """A jobs view that is only taken from the frame when something renders it."""
+
+    def __init__(self, jobs_df, index, filters, refine=None):
+        self.jobs_df = jobs_df
+        self.index = index
+        self.filters = filters
+        self.refine = refine
+        self._rows = None
+        self._frame = None
+
+    @property
+    def rows(self):
+        if self._rows is None:
+            self._rows = self.index.rows(**self.filters)
+        return self._rows
+
+    @property
+    def frame(self):
+        if self._frame is None:
+            frame = self.jobs_df.iloc[self.rows]
+            self._frame = frame if self.refine is None else self.refine(frame)
+        return self._frame
+
+    def count(self):
+        # Plain index filters never need the rows themselves
+        if self.refine is None:
+            return len(self.rows)
+        return len(self.frame)
+
+
+class ViewPlan:
+    """The lazy views one role is allowed to render."""
+
+    def __init__(self, jobs_df, index, definitions, names):
+        self.views = {}
+        for name in names:
+            filters, refine = definitions[name]
+            self.views[name] = LazyView(jobs_df, index, filters, refine)
+
+    def __getitem__(self, name):
+        return self.views[name]
+
+
+PAGE_SIZES = [25, 50, 100, 250]
+
+
+def page_slice(df, page, page_size, sort_by=None, ascending=True):
+    """The rows of one grid page, sorted on the server before slicing."""
+    if sort_by:
+        try:
+            df = df.sort_values(sort_by, ascending=ascending, kind="stable", na_position="last")
+        except TypeError:
+            # Columns holding numbers and text sort as text
+            df = df.sort_values(
+                sort_by, ascending=ascending, kind="stable", key=lambda c: c.astype(str)
+            )
+    start = (page - 1) * page_size
+    return df.iloc[start : start + page_size]
+
+
+# Columns each display type's grids show. Types not listed see every column.
+ROLE_COLUMNS = {
+    3: [
+        "Inv No",
+        "Client",
+        "JobName",
+        "JobPriority",
+        "Size",
+        "Material",
+        "MachineTime",
+        "MachineInUse",
+        "Status",
+        "EstimatedDeliveryDate",
+    ],
+    5: [
+        "Inv No",
+        "Client",
+        "ClientType",
+        "JobName",
+        "JobPriority",
+        "Size",
+        "Status",
+        "CODStatus",
+        "EstimatedDeliveryDate",
+    ],
+}
+
+# Extra columns a view needs on top of its role's
+VIEW_COLUMNS = {
+    "proof_approval": ["Proof", "ProofApprovalTime"],
+    "waiting_cod_payment": ["ClientType", "CODStatus", "TotalCost"],
+    "cutting_in_progress": ["MachineInUse", "CNCStartTime"],
+    "delivered_today": ["JobCompletedTime"],
+}
+
+# Sent because row styling reads them, but never shown
+HIDDEN_COLUMNS = ["OverdueCheck", "Revision"]
+
+# Few distinct values, so read-only grids get them as small integer codes
+CODED_COLUMNS = [
+    "Status",
+    "ClientType",
+    "CODStatus",
+    "JobPriority",
+    "JobType",
+    "MachineInUse",
+    "DTPOperator",
+]
+
+
+def grid_columns(displaytype, view=None):
+    """The columns `displaytype` sees in `view`, or `None` for all of them."""
+    if displaytype not in ROLE_COLUMNS:
+        return None
+    return ["id"] + ROLE_COLUMNS[displaytype] + VIEW_COLUMNS.get(view, []) + HIDDEN_COLUMNS
+
+
+def compact(df, columns=None):
+    """Narrows `df` to `columns` and turns timestamps and durations into display text."""
+    if columns is not None:
+        df = df[[c for c in dict.fromkeys(columns) if c in df.columns]]
+    df = df.copy()
+    for column in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[column]):
+            df[column] = df[column].dt.strftime(DATETIME_FORMATS[0]).fillna("")
+        elif pd.api.types.is_timedelta64_dtype(df[column]):
+            df[column] = df[column].map(lambda v: "" if pd.isna(v) else format_duration(v))
+    return df
+
+
+def encode_codes(df, columns=CODED_COLUMNS):
+    """Swaps text columns for integer codes. Returns the frame and `{column: {code: text}}`."""
+    df = df.copy()
+    ref_data = {}
+    for column in columns:
+        if column in df.columns:
+            # Sorted so the codes sort in the same order as their labels
+            codes, labels = pd.factorize(df[column].astype(str), sort=True)
+            df[column] = codes
+            ref_data[column] = {str(code): label for code, label in enumerate(labels)}
+    return df, ref_data
@@ -0,0 +1,185 @@
+import bisect
+import collections
+import logging
+import random
+import threading
+import time
+
+from gspread.exceptions import APIError
+from gspread.spreadsheet import Spreadsheet
+from gspread.worksheet import Worksheet
+
+logger = logging.getLogger(__name__)
+
+# Worksheet and spreadsheet calls that only read, so identical ones in flight can share a response
+READ_METHODS = {
+    "get_all_records",
+    "get_all_values",
+    "row_values",
+    "col_values",
+    "batch_get",
+    "get",
+    "acell",
+    "cell",
+}
+
+# Status codes worth retrying a read on: rate limited or a server hiccup
+RETRY_CODES = {429, 500, 502, 503, 504}
+
+# A write that failed on the server may still have landed, so it is only retried when rate limited
+WRITE_RETRY_CODES = {429}
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = [0.1, 0.25, 0.5, 1, 2, 5, 10, float("inf")]
+
+
+class CallStats:
+    """Call counts and latency histograms per API method."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = collections.Counter()
+        self.errors = collections.Counter()
+        self.coalesced = collections.Counter()
+        self.latency = collections.defaultdict(lambda: [0] * len(LATENCY_BUCKETS))
+
+    def record(self, method, seconds, failed=False):
+        with self.lock:
+            self.calls[method] += 1
+            if failed:
+                self.errors[method] += 1
+            self.latency[method][bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+    def record_coalesced(self, method):
+        with self.lock:
+            self.coalesced[method] += 1
+
+    def summary(self):
+        """`{method: {"calls", "errors", "coalesced", "latency"}}`, latency keyed by bucket bound."""
+        with self.lock:
+            return {
+                method: {
+                    "calls": self.calls[method],
+                    "errors": self.errors[method],
+                    "coalesced": self.coalesced[method],
+                    "latency": dict(zip(LATENCY_BUCKETS, self.latency[method])),
+                }
+                for method in sorted(set(self.calls) | set(self.coalesced))
+            }
+
+
+class SheetQuota:
+    """Shared request budget, retry policy and accounting for every sheet call."""
+
+    def __init__(self, per_minute=60, retries=5, base_delay=1.0, max_delay=32.0):
+        self.per_minute = per_minute
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.stats = CallStats()
+        self.lock = threading.Lock()
+        self.sent = collections.deque()
+        # (method, args) -> [done event, result, error] for reads in flight
+        self.in_flight = {}
+
+    def _prune(self, now):
+        while self.sent and now - self.sent[0] >= 60:
+            self.sent.popleft()
+
+    def acquire(self):
+        # Block until the last minute has room for one more request
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._prune(now)
+                if len(self.sent) < self.per_minute:
+                    self.sent.append(now)
+                    return
+                wait = 60 - (now - self.sent[0])
+            time.sleep(wait)
+
+    def used(self):
+        """Share of the per-minute budget spent over the last minute."""
+        with self.lock:
+            self._prune(time.monotonic())
+            return len(self.sent) / self.per_minute
+
+    def stretch(self, interval):
+        # Poll less often as the budget runs out, up to four times slower
+        used = self.used()
+        if used < 0.5:
+            return interval
+        return interval * (1 + 6 * (min(used, 1.0) - 0.5))
+
+    def call(self, method, func, *args, **kwargs):
+        if method not in READ_METHODS:
+            return self._send(method, func, *args, **kwargs)
+
+        key = (id(getattr(func, "__self__", None)), method, repr(args), repr(sorted(kwargs.items())))
+        with self.lock:
+            waiting = self.in_flight.get(key)
+            if waiting is None:
+                waiting = self.in_flight[key] = [threading.Event(), None, None]
+                leader = True
+            else:
+                leader = False
+
+        if not leader:
+            self.stats.record_coalesced(method)
+            waiting[0].wait()
+            if waiting[2] is not None:
+                raise waiting[2]
+            return waiting[1]
+
+        try:
+            waiting[1] = self._send(method, func, *args, **kwargs)
+            return waiting[1]
+        except Exception as e:
+            waiting[2] = e
+            raise
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+            waiting[0].set()
+
+    def _send(self, method, func, *args, **kwargs):
+        retry_codes = RETRY_CODES if method in READ_METHODS else WRITE_RETRY_CODES
+        for attempt in range(self.retries + 1):
+            self.acquire()
+            start = time.monotonic()
+            try:
+                result = func(*args, **kwargs)
+            except APIError as e:
+                self.stats.record(method, time.monotonic() - start, failed=True)
+                if e.code not in retry_codes or attempt == self.retries:
+                    raise
+                # Exponential backoff with full jitter
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+                logger.warning("Sheets %s failed with %s, retrying in %.1fs", method, e.code, delay)
+                time.sleep(delay)
+            else:
+                self.stats.record(method, time.monotonic() - start)
+                return result
+
+
+class QuotaProxy:
+    """Wraps a gspread client, spreadsheet or worksheet so every call goes through `quota`."""
+
+    def __init__(self, target, quota):
+        self._target = target
+        self._quota = quota
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        if isinstance(value, (Spreadsheet, Worksheet)):
+            return QuotaProxy(value, self._quota)
+        if not callable(value):
+            return value
+
+        def call(*args, **kwargs):
+            result = self._quota.call(name, value, *args, **kwargs)
+            if isinstance(result, (Spreadsheet, Worksheet)):
+                return QuotaProxy(result, self._quota)
+            return result
+
+        return call
@@ -0,0 +1,89 @@
+import pandas as pd
+
+from job_changes import JobChanges, diff_cells, id_positions
+from job_schema import parse_jobs
+from job_store import SQLiteStore, rebase
+
+
+def test_rebase_keeps_cells_nobody_else_changed():
+    cells = {(1, "Status"): "Ready For QC", (1, "Material"): "MDF"}
+    base = {(1, "Status"): "Artwork", (1, "Material"): "Acrylic"}
+    live = {1: {"Status": "Artwork", "Material": "Wood"}}
+    keep, errors = rebase(cells, base, live)
+    assert keep == {}
+    assert errors == {1: "changed by someone else meanwhile: Material"}
+
+    live = {1: {"Status": "Artwork", "Material": "Acrylic", "Client": "Someone"}}
+    keep, errors = rebase(cells, base, live)
+    assert keep == cells
+    assert errors == {}
+
+
+def test_rebase_reads_stored_text_like_the_frame():
+    # Hand-typed dates and durations are still the value the change was made against
+    base = {
+        (1, "EstimatedDeliveryDate"): pd.Timestamp("2024-10-20"),
+        (1, "MachineTime"): pd.Timedelta(hours=2, minutes=30),
+        (1, "Inv No"): 5,
+    }
+    cells = {
+        (1, "EstimatedDeliveryDate"): pd.Timestamp("2024-10-25"),
+        (1, "MachineTime"): pd.Timedelta(hours=3),
+        (1, "Inv No"): 6,
+    }
+    live = {1: {"EstimatedDeliveryDate": "2024/10/20 00:00", "MachineTime": "2:30:00", "Inv No": "5"}}
+    keep, errors = rebase(cells, base, live)
+    assert keep == cells
+    assert errors == {}
+
+    live[1]["EstimatedDeliveryDate"] = "2024/10/21 00:00"
+    keep, errors = rebase(cells, base, live)
+    assert errors == {1: "changed by someone else meanwhile: EstimatedDeliveryDate"}
+
+
+def test_sqlite_edit_of_hand_typed_date_is_saved(tmp_path):
+    store = SQLiteStore(str(tmp_path / "jobs.db"), seed_csv=str(tmp_path / "none.csv"))
+    store.seed(
+        pd.DataFrame(
+            {
+                "id": [1, 2],
+                "Status": ["Artwork", "Artwork"],
+                "EstimatedDeliveryDate": ["2024/10/20 00:00", "2024-10-22 00:00:00"],
+            }
+        )
+    )
+    jobs_df = parse_jobs(store.load())
+    edited = jobs_df.copy()
+    edited.loc[0, "EstimatedDeliveryDate"] = pd.Timestamp("2024-10-25")
+
+    changes = JobChanges(jobs_df)
+    diff = diff_cells(jobs_df, edited, id_positions(jobs_df))
+    assert diff[["id", "column"]].values.tolist() == [[1, "EstimatedDeliveryDate"]]
+    changes.apply_diff(diff)
+    assert changes.commit(store) == {}
+
+    saved = parse_jobs(store.load()).set_index("id")["EstimatedDeliveryDate"]
+    assert saved[1] == pd.Timestamp("2024-10-25")
+    assert saved[2] == pd.Timestamp("2024-10-22")
+
+
+def test_diff_cells_only_returns_changed_cells():
+    jobs_df = parse_jobs(
+        pd.DataFrame(
+            {
+                "id": [1, 2, 3],
+                "Client": ["A", "B", "C"],
+                "TotalCost": [10, 20, 30],
+                "EstimatedDeliveryDate": ["2024-10-20", "", "2024-10-22"],
+            }
+        )
+    )
+    # The grid hands values back untyped
+    edited = jobs_df.astype(object)
+    edited.loc[1, "Client"] = "Bee"
+    edited.loc[2, "TotalCost"] = "35"
+    # Jobs that are no longer in the frame are left out
+    edited = pd.concat([edited, edited.iloc[[0]].assign(id=9, Client="Gone")], ignore_index=True)
+
+    diff = diff_cells(jobs_df, edited, id_positions(jobs_df))
+    assert diff.values.tolist() == [[2, "Client", "B", "Bee"], [3, "TotalCost", 30, 35]]
@@ -0,0 +1,72 @@
+import json
+
+import pandas as pd
+
+from write_queue import decode_op, encode_op, merge_ops, overlay
+
+
+def cells_op(cells, base=None, origin="a"):
+    return ("cells", {"cells": cells, "base": base or {}, "revisions": {}, "origin": origin})
+
+
+def test_merge_keeps_writes_to_one_cell_apart():
+    ops = [
+        cells_op({(1, "Status"): "Artwork"}, {(1, "Status"): "New"}),
+        cells_op({(2, "Status"): "Artwork"}),
+        cells_op({(1, "Status"): "Ready For QC"}, {(1, "Status"): "Artwork"}),
+        cells_op({(3, "Material"): "MDF"}),
+    ]
+    merged = merge_ops(ops)
+    assert [(kind, group["cells"], count) for kind, group, count in merged] == [
+        ("cells", {(1, "Status"): "Artwork", (2, "Status"): "Artwork"}, 2),
+        ("cells", {(1, "Status"): "Ready For QC", (3, "Material"): "MDF"}, 2),
+    ]
+    # Each write is checked against the value it was made on
+    assert merged[1][1]["base"] == {(1, "Status"): "Artwork"}
+
+
+def test_merge_splits_one_job_written_by_two_sessions():
+    ops = [
+        cells_op({(1, "Status"): "Artwork"}, origin="a"),
+        cells_op({(1, "Material"): "MDF"}, origin="b"),
+        ("append", {"job": {"id": 5}, "origin": "a"}),
+        ("append", {"job": {"id": 6}, "origin": "b"}),
+        ("delete", {"ids": [2], "origin": "b"}),
+    ]
+    merged = merge_ops(ops)
+    assert [(kind, group["origins"], count) for kind, group, count in merged] == [
+        ("cells", {1: "a"}, 1),
+        ("cells", {1: "b"}, 1),
+        ("append", {5: "a", 6: "b"}, 2),
+        ("delete", {2: "b"}, 1),
+    ]
+    assert merged[2][1]["jobs"] == [{"id": 5}, {"id": 6}]
+
+
+def test_journal_round_trip_and_old_entries():
+    op = cells_op({(1, "Status"): "Artwork"}, {(1, "Status"): "New"})
+    assert decode_op(json.loads(json.dumps(encode_op(*op)))) == op
+
+    assert decode_op({"kind": "cells", "payload": [[1, "Status", "Artwork"]]})[1]["cells"] == {
+        (1, "Status"): "Artwork"
+    }
+    assert decode_op({"kind": "append", "payload": {"id": 5}}) == (
+        "append",
+        {"job": {"id": 5}, "origin": None},
+    )
+    assert decode_op({"kind": "delete", "payload": [2]}) == ("delete", {"ids": [2], "origin": None})
+
+
+def test_overlay_applies_queued_writes():
+    df = pd.DataFrame({"id": [1, 2], "Status": ["New", "New"]})
+    ops = [
+        cells_op({(1, "Status"): "Artwork"}),
+        ("append", {"job": {"id": 3, "Status": "New"}, "origin": "a"}),
+        # Already landed, so not added twice
+        ("append", {"job": {"id": 2, "Status": "New"}, "origin": "a"}),
+        ("delete", {"ids": [2], "origin": "a"}),
+    ]
+    assert overlay(df, ops).to_dict("records") == [
+        {"id": 1, "Status": "Artwork"},
+        {"id": 3, "Status": "New"},
+    ]
@@ -0,0 +1,307 @@
+import json
+import logging
+import os
+import threading
+import time
+
+import pandas as pd
+from gspread.exceptions import APIError
+
+from job_changes import assign
+from job_store import JobStore, sql_value
+
+logger = logging.getLogger(__name__)
+
+# Longest wait (seconds) between flush attempts while the store is unreachable
+MAX_BACKOFF = 60
+
+# Past tense of each kind of write, for the errors shown to the session that made it
+ACTIONS = {"cells": "updated", "append": "added", "delete": "deleted"}
+
+
+def encode_cells(cells):
+    return [
+        [sql_value(job_id), column, sql_value(value)]
+        for (job_id, column), value in cells.items()
+    ]
+
+
+def decode_cells(entries):
+    return {(job_id, column): value for job_id, column, value in entries}
+
+
+def encode_op(kind, payload):
+    # Journal entries only hold plain JSON values
+    if kind == "cells":
+        payload = {
+            "cells": encode_cells(payload["cells"]),
+            "base": encode_cells(payload["base"]),
+            "revisions": [
+                [sql_value(job_id), sql_value(rev)]
+                for job_id, rev in payload["revisions"].items()
+            ],
+            "origin": payload.get("origin"),
+        }
+    elif kind == "append":
+        payload = {
+            "job": {column: sql_value(value) for column, value in payload["job"].items()},
+            "origin": payload["origin"],
+        }
+    else:
+        payload = {"ids": [sql_value(job_id) for job_id in payload["ids"]], "origin": payload["origin"]}
+    return {"kind": kind, "payload": payload}
+
+
+def decode_op(entry):
+    kind, payload = entry["kind"], entry["payload"]
+    if kind == "cells":
+        if isinstance(payload, list):
+            # Written before writes carried their base values
+            payload = {"cells": payload, "base": [], "revisions": []}
+        payload = {
+            "cells": decode_cells(payload["cells"]),
+            "base": decode_cells(payload["base"]),
+            "revisions": dict(payload["revisions"]),
+            "origin": payload.get("origin"),
+        }
+    elif kind == "append" and "job" not in payload:
+        # Written before appends and deletes carried their origin
+        payload = {"job": payload, "origin": None}
+    elif kind == "delete" and isinstance(payload, list):
+        payload = {"ids": payload, "origin": None}
+    return kind, payload
+
+
+def op_ids(kind, payload):
+    if kind == "cells":
+        return [job_id for job_id, _ in payload["cells"]]
+    if kind == "append":
+        return [payload["job"]["id"]]
+    return payload["ids"]
+
+
+def permanent(error):
+    # The sheet turned the request itself down, so sending it again won't help
+    return isinstance(error, APIError) and 400 <= error.code < 500 and error.code != 429
+
+
+class WriteBehindStore(JobStore):
+    """Queues writes and flushes them to `store` from one background thread.
+
+    Queued writes are kept in a journal file until they reach the store, so
+    they are retried after a crash. Until then `load` overlays them on what
+    the store returns. Updates the store turns down at flush time are kept
+    for the session that made them and `version` is bumped so it reruns.
+    Flushes that fail on the way (network, rate limits, server errors) are
+    retried until they land; a write the store refuses outright is moved
+    to the dead-letter journal and reported the same way.
+    """
+
+    def __init__(
+        self,
+        store,
+        journal_path="foilworx_writes.jsonl",
+        interval=1.0,
+        version=None,
+        dead_letter_path="foilworx_writes.dead.jsonl",
+    ):
+        self.store = store
+        self.journal_path = journal_path
+        self.dead_letter_path = dead_letter_path
+        self.interval = interval
+        self.version = version
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.pending = []
+        self.failures = 0
+        # origin -> {id: error} for queued writes the store turned down
+        self.rejected = {}
+
+        if os.path.exists(journal_path):
+            with open(journal_path) as journal:
+                self.pending = [decode_op(json.loads(line)) for line in journal if line.strip()]
+
+        self.worker = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self.worker.start()
+
+    def _enqueue(self, kind, payload):
+        with self.lock:
+            self.pending.append((kind, payload))
+            with open(self.journal_path, "a") as journal:
+                journal.write(json.dumps(encode_op(kind, payload)) + "\n")
+                journal.flush()
+                os.fsync(journal.fileno())
+        self.wake.set()
+
+    def update_cells(self, cells, base=None, revisions=None, origin=None):
+        self._enqueue(
+            "cells",
+            {
+                "cells": dict(cells),
+                "base": dict(base or {}),
+                "revisions": dict(revisions or {}),
+                "origin": origin,
+            },
+        )
+        # Conflicts are found when the write is flushed, see `take_rejected`
+        return {}
+
+    def take_rejected(self, origin):
+        with self.lock:
+            return self.rejected.pop(origin, {})
+
+    def append_job(self, job, origin=None):
+        self._enqueue("append", {"job": dict(job), "origin": origin})
+
+    def delete_jobs(self, job_ids, origin=None):
+        self._enqueue("delete", {"ids": list(job_ids), "origin": origin})
+        # The rows are matched by id when the delete is flushed
+        return {job_id: None for job_id in job_ids}
+
+    def load(self):
+        df = self.store.load()
+        with self.lock:
+            pending = list(self.pending)
+        return overlay(df, pending)
+
+    def refresh(self):
+        df = self.store.refresh()
+        with self.lock:
+            pending = list(self.pending)
+        return overlay(df, pending)
+
+    def _run(self):
+        alone = False
+        while True:
+            self.wake.wait(self.interval)
+            self.wake.clear()
+            try:
+                self.flush(alone)
+                self.failures = 0
+                alone = False
+            except Exception as e:
+                if permanent(e):
+                    logger.exception("Write-behind flush refused by the store")
+                    if alone:
+                        # Don't let one bad write hold up everything queued behind it
+                        self._dead_letter(e)
+                    # Otherwise send the first write on its own to see if it is the bad one
+                    alone = not alone
+                    continue
+                # Leave the writes queued and back off before trying again
+                self.failures += 1
+                logger.exception("Write-behind flush failed (attempt %s)", self.failures)
+                time.sleep(min(MAX_BACKOFF, 2 ** min(self.failures, 6)))
+
+    def flush(self, alone=False):
+        """Sends the queued writes, or only the first one if `alone`."""
+        with self.lock:
+            batch = list(self.pending[:1] if alone else self.pending)
+
+        for kind, payload, count in merge_ops(batch):
+            if kind == "cells":
+                conflicts = self.store.update_cells(
+                    payload["cells"], base=payload["base"], revisions=payload["revisions"]
+                )
+                if conflicts:
+                    self._reject(conflicts, payload["origins"], ACTIONS[kind])
+            elif kind == "append":
+                self.store.append_jobs(payload["jobs"])
+            else:
+                for job_id, error in self.store.delete_jobs(payload["ids"]).items():
+                    if error:
+                        logger.warning("Queued delete of job %s: %s", job_id, error)
+            # Drop each group as soon as it lands so a retry never repeats it
+            self._done(count)
+
+    def _reject(self, errors, origins, action):
+        with self.lock:
+            for job_id, error in errors.items():
+                logger.warning("Queued write to job %s dropped, not %s: %s", job_id, action, error)
+                self.rejected.setdefault(origins.get(job_id), {})[job_id] = f"was not {action}: {error}"
+        # The overlaid frames showed the dropped write, so they are stale now
+        if self.version is not None:
+            self.version.bump()
+
+    def _dead_letter(self, error):
+        with self.lock:
+            if not self.pending:
+                return
+            kind, payload = self.pending[0]
+            with open(self.dead_letter_path, "a") as dead:
+                entry = {**encode_op(kind, payload), "error": str(error), "at": time.time()}
+                dead.write(json.dumps(entry) + "\n")
+        logger.error("Queued %s write refused, kept in %s: %s", kind, self.dead_letter_path, error)
+        job_ids = op_ids(kind, payload)
+        self._reject(
+            {job_id: str(error) for job_id in job_ids},
+            {job_id: payload["origin"] for job_id in job_ids},
+            ACTIONS[kind],
+        )
+        self._done(1)
+
+    def _done(self, count):
+        with self.lock:
+            del self.pending[:count]
+            with open(self.journal_path, "w") as journal:
+                for kind, payload in self.pending:
+                    journal.write(json.dumps(encode_op(kind, payload)) + "\n")
+
+
+def cells_fit(group, payload):
+    # An update joins a group only if none of its cells are already in it, so
+    # every write to a cell is checked on its own, and its jobs belong to the
+    # same session, so a dropped job is reported to the right one
+    return not any(key in group["cells"] for key in payload["cells"]) and all(
+        group["origins"].get(job_id, payload["origin"]) == payload["origin"]
+        for job_id in op_ids("cells", payload)
+    )
+
+
+def merge_ops(ops):
+    # Collapse runs of the same kind of write into one store call
+    merged = []
+    for kind, payload in ops:
+        if merged and merged[-1][0] == kind and (kind != "cells" or cells_fit(merged[-1][1], payload)):
+            group = merged[-1][1]
+            if kind == "cells":
+                group["cells"].update(payload["cells"])
+                # The earliest base is what the stored rows are compared against
+                for key, value in payload["base"].items():
+                    group["base"].setdefault(key, value)
+                for job_id, rev in payload["revisions"].items():
+                    group["revisions"].setdefault(job_id, rev)
+            elif kind == "append":
+                group["jobs"].append(payload["job"])
+            else:
+                group["ids"].extend(payload["ids"])
+            merged[-1][2] += 1
+        else:
+            if kind == "cells":
+                group = {part: dict(payload[part]) for part in ("cells", "base", "revisions")}
+            elif kind == "append":
+                group = {"jobs": [payload["job"]]}
+            else:
+                group = {"ids": list(payload["ids"])}
+            group["origins"] = {}
+            merged.append([kind, group, 1])
+        # Who made each write, so a dropped one is reported to them
+        for job_id in op_ids(kind, payload):
+            group["origins"][job_id] = payload["origin"]
+    return merged
+
+
+def overlay(df, ops):
+    # Apply writes that have not reached the store yet to a loaded frame
+    df = df.copy()
+    for kind, payload in ops:
+        if kind == "cells":
+            for (job_id, column), value in payload["cells"].items():
+                assign(df, df["id"] == job_id, column, value)
+        elif kind == "append":
+            # The append may already have landed while it was being flushed
+            if not (df["id"] == payload["job"]["id"]).any():
+                df = pd.concat([df, pd.DataFrame([payload["job"]])], ignore_index=True)
+        else:
+            df = df.loc[~df["id"].isin(payload["ids"])].reset_index(drop=True)
+    return df